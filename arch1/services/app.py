@@ -4,12 +4,19 @@ import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import Flask, request, jsonify, Response
 import requests, os
+from requests.adapters import HTTPAdapter
 
 app = Flask(__name__)
 
 STORAGE_API = "http://storage:5002" # storage service URL
 METADATA_API = "http://metadata:5001" # metadata service URL
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey") # secret key for JWT - in more secure setup, use env variable
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32")) # keep-alive connections kept open to each backend service
+PROXY_CHUNK_SIZE = int(os.environ.get("PROXY_CHUNK_SIZE", str(1024 * 1024))) # bytes read from storage per chunk of a proxied download
+
+# one keep-alive session for every call to storage and metadata, instead of a new connection per request
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=HTTP_POOL_SIZE))
 
 
 # --- JWT Helpers ---
@@ -46,7 +53,7 @@ def signup():
     hashed_password = generate_password_hash(password)
     try:
         # send to metadata service
-        resp = requests.post(f"{METADATA_API}/users", json={
+        resp = http.post(f"{METADATA_API}/users", json={
             "username": username,
             "password": hashed_password
         })
@@ -74,7 +81,7 @@ def login():
 
     try:
         # fetch user from metadata service
-        resp = requests.get(f"{METADATA_API}/users/{username}")
+        resp = http.get(f"{METADATA_API}/users/{username}")
 
         # check the response
         if resp.status_code != 200:
@@ -125,7 +132,7 @@ def upload():
     files = {'file': (file.filename, file.stream, file.mimetype)}
 
     # forward the file to the storage service via POST
-    resp = requests.post(f"{STORAGE_API}/upload", files=files)
+    resp = http.post(f"{STORAGE_API}/upload", files=files)
 
     # check response from storage service
     if resp.status_code != 200:
@@ -147,12 +154,12 @@ def download():
 
     # forward request to storage service via GET
     params = {"filename": filename}
-    resp = requests.get(f"{STORAGE_API}/download", params=params, stream=True)
+    resp = http.get(f"{STORAGE_API}/download", params=params, stream=True)
 
     # check response from storage service
     if resp.status_code == 200:
         return Response(
-            resp.iter_content(chunk_size=8192),
+            resp.iter_content(chunk_size=PROXY_CHUNK_SIZE),
             content_type=resp.headers.get('Content-Type'),
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
@@ -167,7 +174,7 @@ def download():
 @require_auth
 def list_files():
     # forward request to metadata service via GET
-    resp = requests.get(f"{METADATA_API}/files")
+    resp = http.get(f"{METADATA_API}/files")
 
     # check response from metadata service
     if resp.status_code == 200:
@@ -186,7 +193,7 @@ def delete_file():
     
     # forward request to storage service via DELETE
     params = {"filename": filename}
-    resp = requests.delete(f"{STORAGE_API}/delete", params=params)
+    resp = http.delete(f"{STORAGE_API}/delete", params=params)
     # check response from metadata service
     if resp.status_code == 200:
         return resp.json(), resp.status_code
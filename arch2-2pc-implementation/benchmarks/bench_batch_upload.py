@@ -0,0 +1,51 @@
+# Small-file ingest through a running cluster: one 2PC round per file versus one batched round.
+#
+#   python benchmarks/bench_batch_upload.py --files 500 --size 4096
+#
+# Signs up a throwaway user, then uploads --files files one at a time through /files/upload
+# and another --files through a single /files/upload/batch request.
+import argparse
+import os
+import time
+import uuid
+
+import requests
+
+
+def login(api_url):
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    requests.post(f"{api_url}/auth/signup", json={"username": username, "password": "bench"}).raise_for_status()
+    resp = requests.post(f"{api_url}/auth/login", json={"username": username, "password": "bench"})
+    resp.raise_for_status()
+    return {"Authorization": f"Bearer {resp.json()['token']}"}
+
+
+def report(mode, count, elapsed):
+    print(f"{mode:<24} {count / elapsed:>10.1f} files/sec   ({elapsed:.2f}s for {count} files)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched upload benchmark")
+    parser.add_argument("--files", type=int, default=500, help="files uploaded in each mode")
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--api-url", default=os.environ.get("API_URL", "http://upload:5003"))
+    args = parser.parse_args()
+
+    headers = login(args.api_url)
+    run_id = uuid.uuid4().hex[:8]
+    session = requests.Session()
+
+    started = time.monotonic()
+    for i in range(args.files):
+        files = {"file": (f"single-{run_id}-{i}.bin", os.urandom(args.size))}
+        session.post(f"{args.api_url}/files/upload", files=files, headers=headers).raise_for_status()
+    report("one 2PC round per file", args.files, time.monotonic() - started)
+
+    files = [("files", (f"batch-{run_id}-{i}.bin", os.urandom(args.size))) for i in range(args.files)]
+    started = time.monotonic()
+    session.post(f"{args.api_url}/files/upload/batch", files=files, headers=headers).raise_for_status()
+    report("one batched 2PC round", args.files, time.monotonic() - started)
+
+
+if __name__ == "__main__":
+    main()
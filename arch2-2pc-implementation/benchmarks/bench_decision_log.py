@@ -0,0 +1,63 @@
+# Committed transactions/sec through the coordinator decision log, with and without group commit.
+#
+#   python benchmarks/bench_decision_log.py --threads 32 --seconds 5
+#
+# Every simulated transaction writes what the coordinator writes per upload: an unforced
+# start record, a forced decision record and an unforced end record.
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "services", "upload"))
+from decision_log import DecisionLog
+
+
+def run(directory, group_commit, threads, seconds, batch_ms):
+    path = os.path.join(directory, f"decisions-{'group' if group_commit else 'single'}.log")
+    log = DecisionLog(path, group_commit=group_commit, batch_window=batch_ms / 1000)
+    committed = [0] * threads
+    stop = time.monotonic() + seconds
+
+    def worker(index):
+        n = 0
+        while time.monotonic() < stop:
+            txn_id = f"{index}-{n}"
+            log.append({"type": "start", "txn": txn_id, "participants": ["2", "3", "4", "5"]})
+            log.append({"type": "decision", "txn": txn_id, "decision": "commit", "participants": ["2", "3", "4", "5"]}, force=True)
+            log.append({"type": "end", "txn": txn_id})
+            n += 1
+        committed[index] = n
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.monotonic() - started
+    log.close()
+
+    total = sum(committed)
+    mode = f"group commit ({batch_ms:g} ms window)" if group_commit else "fsync per decision"
+    print(f"{mode:<32} {total / elapsed:>10.1f} txns/sec   {log.fsyncs / max(total, 1):.3f} fsyncs/txn")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decision log group commit benchmark")
+    parser.add_argument("--threads", type=int, default=32, help="concurrent transactions")
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each run")
+    parser.add_argument("--batch-ms", type=float, default=0, help="group commit batch window")
+    parser.add_argument("--dir", help="directory for the log files (defaults to a temp dir)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        print(f"{args.threads} concurrent transactions, {args.seconds:g}s per run, log in {directory}")
+        run(directory, False, args.threads, args.seconds, args.batch_ms)
+        run(directory, True, args.threads, args.seconds, args.batch_ms)
+
+
+if __name__ == "__main__":
+    main()
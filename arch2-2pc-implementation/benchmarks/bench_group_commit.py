@@ -0,0 +1,67 @@
+# Concurrent small uploads through a running cluster - throughput and latency for the current
+# GROUP_COMMIT_WINDOW_MS setting of the upload service.
+#
+#   GROUP_COMMIT_WINDOW_MS=0 docker compose up -d upload && python benchmarks/bench_group_commit.py
+#   GROUP_COMMIT_WINDOW_MS=3 docker compose up -d upload && python benchmarks/bench_group_commit.py
+#
+# Every client thread uploads distinct 4 KiB files back to back for --seconds.
+import argparse
+import os
+import threading
+import time
+import uuid
+
+import requests
+
+
+def login(api_url):
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    requests.post(f"{api_url}/auth/signup", json={"username": username, "password": "bench"}).raise_for_status()
+    resp = requests.post(f"{api_url}/auth/login", json={"username": username, "password": "bench"})
+    resp.raise_for_status()
+    return {"Authorization": f"Bearer {resp.json()['token']}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Group commit benchmark")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent uploading clients")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of the run")
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--api-url", default=os.environ.get("API_URL", "http://upload:5003"))
+    args = parser.parse_args()
+
+    headers = login(args.api_url)
+    run_id = uuid.uuid4().hex[:8]
+    latencies = [[] for _ in range(args.clients)]
+    failures = [0] * args.clients
+    stop = time.monotonic() + args.seconds
+
+    def client(index):
+        session = requests.Session()
+        n = 0
+        while time.monotonic() < stop:
+            files = {"file": (f"group-{run_id}-{index}-{n}.bin", os.urandom(args.size))}
+            started = time.monotonic()
+            resp = session.post(f"{args.api_url}/files/upload", files=files, headers=headers)
+            latencies[index].append(time.monotonic() - started)
+            if resp.status_code != 200:
+                failures[index] += 1
+            n += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    samples = sorted(l for per_client in latencies for l in per_client)
+    p50 = samples[len(samples) // 2] * 1000
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+    print(f"{args.clients} clients, {len(samples)} uploads ({sum(failures)} failed) in {elapsed:.1f}s")
+    print(f"{len(samples) / elapsed:>10.1f} uploads/sec   p50 {p50:.1f} ms   p99 {p99:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Bytes per file held by the in-memory metadata stores: the plain dict records they used to keep
+# versus the compact FileRecord they keep now.
+#
+#   python benchmarks/bench_metadata_memory.py --files 1000000
+#
+# Records are built the way GlobalDecision builds them - every field a fresh object, as it arrives
+# from protobuf - and kept in a dict keyed by filename. tracemalloc measures everything allocated,
+# the filename keys included.
+import argparse
+import gc
+import hashlib
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "metadata"))
+from store import FileRecord, file_record
+
+
+def fields(i, users):
+    filename = f"documents/report-{i:09d}.pdf"
+    checksum = hashlib.sha256(filename.encode()).hexdigest()
+    return filename, f"user-{i % users}", 4096 + i, checksum, f"/storage/{filename}", 1
+
+
+def measure(label, make, count, users):
+    gc.collect()
+    tracemalloc.start()
+    files = {}
+    for i in range(count):
+        row = fields(i, users)
+        files[row[0]] = make(*row)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<16} {used / count:>8.1f} bytes/file   ({used / 1024 / 1024:.1f} MiB for {count} files)")
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metadata record memory benchmark")
+    parser.add_argument("--files", type=int, default=1000000, help="records built for each representation")
+    parser.add_argument("--users", type=int, default=1000, help="distinct owners")
+    args = parser.parse_args()
+
+    before = measure("dict records", file_record, args.files, args.users)
+    after = measure("FileRecord", FileRecord, args.files, args.users)
+    print(f"{'saved':<16} {(before - after) / args.files:>8.1f} bytes/file   ({(1 - after / before) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
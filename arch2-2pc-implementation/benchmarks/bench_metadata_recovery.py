@@ -0,0 +1,69 @@
+# Restart time of the "logged" metadata store against the length of the log it has to replay.
+#
+#   python benchmarks/bench_metadata_recovery.py --files 1000000 --tails 0,10000,100000,1000000
+#
+# For every tail length a fresh store directory gets a snapshot of --files records followed by that
+# many logged commits, then the time to open the store again (load snapshot + replay tail) is reported.
+# The last line replays the same number of records from the log alone, without a snapshot.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "metadata"))
+from store import FileRecord, LoggedStore
+
+
+def record(i, prefix):
+    filename = f"{prefix}-{i:09d}.bin"
+    return {
+        "filename": filename, "user": f"user-{i % 1000}", "size": 4096,
+        "checksum": "0" * 64, "path": f"/storage/{filename}", "version": 1
+    }
+
+
+def restart(directory):
+    started = time.monotonic()
+    store = LoggedStore(directory, snapshot_every=1 << 62, sync=False)
+    elapsed = time.monotonic() - started
+    count = len(store.files)
+    store.close()
+    return elapsed, count
+
+
+def build(directory, snapshot_files, tail):
+    store = LoggedStore(directory, snapshot_every=1 << 62, sync=False)
+    if snapshot_files:
+        files = {}
+        for i in range(snapshot_files):
+            r = record(i, "snap")
+            files[r["filename"]] = FileRecord(**r)
+        store._snapshot(store.segment, files, {})
+    for i in range(tail):
+        store.put_file(record(i, "tail"))
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metadata store recovery benchmark")
+    parser.add_argument("--files", type=int, default=1000000, help="records in the snapshot")
+    parser.add_argument("--tails", default="0,10000,100000,1000000", help="comma-separated log tail lengths")
+    args = parser.parse_args()
+
+    tails = [int(t) for t in args.tails.split(",")]
+    print(f"{'snapshot':>10} {'log tail':>10} {'restart':>10}")
+    for snapshot_files, tail in [(args.files, t) for t in tails] + [(0, args.files + tails[-1])]:
+        directory = tempfile.mkdtemp(prefix="bench-recovery-")
+        try:
+            build(directory, snapshot_files, tail)
+            elapsed, count = restart(directory)
+            assert count == snapshot_files + tail
+            print(f"{snapshot_files:>10} {tail:>10} {elapsed:>9.2f}s")
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# Point lookups, list pages and commits against a metadata store holding --files records.
+#
+#   python benchmarks/bench_metadata_store.py --files 10000000 --path /tmp/bench-metadata.db
+#
+# The database is filled once in bulk (an existing one with enough rows is reused), then random
+# get_file calls, 100-file list_files pages from random cursors and put_file commits - one
+# transaction each, as GlobalDecision does - are timed.
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "metadata"))
+from store import SQLiteStore
+
+
+def fill(store, count, users):
+    with store._conn() as conn:
+        have = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        if have >= count:
+            return
+        print(f"Filling {count - have} records...")
+        started = time.monotonic()
+        chunk = 100000
+        for start in range(have, count, chunk):
+            rows = [
+                (f"file-{i:09d}.bin", f"user-{i % users}", 4096, "0" * 64, f"/storage/file-{i:09d}.bin", 1)
+                for i in range(start, min(count, start + chunk))
+            ]
+            with conn:
+                conn.executemany(store.PUT_FILE, rows)
+        print(f"Filled in {time.monotonic() - started:.1f}s")
+
+
+def report(label, samples):
+    samples.sort()
+    p50 = samples[len(samples) // 2] * 1e6
+    p99 = samples[int(len(samples) * 0.99)] * 1e6
+    print(f"{label:<12} p50 {p50:>8.1f} us   p99 {p99:>8.1f} us   ({len(samples)} ops)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metadata store benchmark")
+    parser.add_argument("--files", type=int, default=1000000, help="records in the store")
+    parser.add_argument("--users", type=int, default=1000, help="distinct owners")
+    parser.add_argument("--ops", type=int, default=20000, help="timed operations of each kind")
+    parser.add_argument("--path", default="/tmp/bench-metadata.db")
+    parser.add_argument("--synchronous", default="FULL", help="SQLite synchronous pragma for the commits")
+    args = parser.parse_args()
+
+    store = SQLiteStore(args.path, synchronous=args.synchronous)
+    fill(store, args.files, args.users)
+
+    samples = []
+    for _ in range(args.ops):
+        filename = f"file-{random.randrange(args.files):09d}.bin"
+        started = time.perf_counter()
+        store.get_file(filename)
+        samples.append(time.perf_counter() - started)
+    report("get_file", samples)
+
+    samples = []
+    for _ in range(min(args.ops, 2000)):
+        after = f"file-{random.randrange(args.files):09d}.bin"
+        started = time.perf_counter()
+        store.list_files(100, after)
+        samples.append(time.perf_counter() - started)
+    report("list page", samples)
+
+    samples = []
+    run_id = random.randrange(1 << 30)
+    for i in range(min(args.ops, 2000)):
+        record = {
+            "filename": f"bench-{run_id}-{i}.bin", "user": "bench", "size": 1,
+            "checksum": "0" * 64, "path": "/storage/bench.bin", "version": 1
+        }
+        started = time.perf_counter()
+        store.put_file(record)
+        samples.append(time.perf_counter() - started)
+    report("put_file", samples)
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# Single-file download throughput through a running cluster for the current STRIPE_CONCURRENCY and
+# STRIPE_SIZE settings of the download service.
+#
+#   STRIPE_CONCURRENCY=1 docker compose up -d download && python benchmarks/bench_striped_download.py
+#   STRIPE_CONCURRENCY=4 docker compose up -d download && python benchmarks/bench_striped_download.py
+#
+# One --size MiB file is uploaded, then downloaded --runs times one after another; every copy is
+# checked against the uploaded bytes.
+import argparse
+import hashlib
+import os
+import time
+import uuid
+
+import requests
+
+
+def login(api_url):
+    username = f"bench-{uuid.uuid4().hex[:8]}"
+    requests.post(f"{api_url}/auth/signup", json={"username": username, "password": "bench"}).raise_for_status()
+    resp = requests.post(f"{api_url}/auth/login", json={"username": username, "password": "bench"})
+    resp.raise_for_status()
+    return {"Authorization": f"Bearer {resp.json()['token']}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Striped download benchmark")
+    parser.add_argument("--size", type=int, default=256, help="MiB in the downloaded file")
+    parser.add_argument("--runs", type=int, default=5, help="downloads timed")
+    parser.add_argument("--api-url", default=os.environ.get("API_URL", "http://upload:5003"))
+    parser.add_argument("--download-url", default=os.environ.get("DOWNLOAD_URL", "http://download:5004"))
+    args = parser.parse_args()
+
+    headers = login(args.api_url)
+    filename = f"bench-{uuid.uuid4().hex[:8]}.bin"
+    data = os.urandom(args.size * 1024 * 1024)
+    expected = hashlib.sha256(data).hexdigest()
+    files = {"file": (filename, data)}
+    requests.post(f"{args.api_url}/files/upload", files=files, headers=headers).raise_for_status()
+    del data, files
+
+    rates = []
+    for _ in range(args.runs):
+        digest = hashlib.sha256()
+        started = time.monotonic()
+        resp = requests.get(f"{args.download_url}/files/download", params={"filename": filename}, headers=headers, stream=True)
+        resp.raise_for_status()
+        for chunk in resp.iter_content(chunk_size=1024 * 1024):
+            digest.update(chunk)
+        elapsed = time.monotonic() - started
+        assert digest.hexdigest() == expected, "downloaded bytes differ from the upload"
+        rates.append(args.size / elapsed)
+        print(f"{args.size} MiB in {elapsed:.2f}s   {rates[-1]:.0f} MiB/s")
+
+    rates.sort()
+    print(f"median {rates[len(rates) // 2]:.0f} MiB/s over {args.runs} downloads")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import argparse
+import hashlib
+import json
 import os
+import time
 import requests
 
 # api url for the services
@@ -14,6 +17,14 @@ def save_token(token):
     with open(TOKEN_FILE, "w") as f:
         f.write(token)
 
+# sha256 of a local file, read in chunks so large files are not held in memory
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
 # loading the token from the TOKEN_FILE
 def load_token():
     if os.path.exists(TOKEN_FILE):
@@ -57,6 +68,10 @@ def upload(args):
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
+    # lets the coordinator start 2PC before the whole body has arrived
+    headers["X-Upload-Size"] = str(os.path.getsize(file_name))
+    # lets participants that already hold this exact file skip the commit
+    headers["X-Upload-SHA256"] = file_sha256(file_name)
     resp = requests.post(f"{API_URL}/files/upload", files=files, data=data, headers=headers)
     try:
         print_response(resp)
@@ -64,23 +79,87 @@ def upload(args):
         print("Response: ", resp.text)
         print("Status: ", resp.status_code)
     
-# download file from the storage service - requires token for auth
+# upload many files in one atomic 2PC transaction - directories contribute the files directly inside them
+def upload_batch(args):
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if os.path.isfile(os.path.join(path, name)))
+        else:
+            paths.append(path)
+    token = load_token()
+    headers = {}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    files = [('files', (os.path.basename(path), open(path, 'rb'))) for path in paths]
+    resp = requests.post(f"{API_URL}/files/upload/batch", files=files, headers=headers)
+    try:
+        print_response(resp)
+    except:
+        print("Response: ", resp.text)
+        print("Status: ", resp.status_code)
+
+# download file from the storage service - requires token for auth.
+# bytes land in <output>.part first, so a dropped connection (or a rerun after one) continues from
+# where it stopped - If-Range makes the server send the whole file again if it has changed since
 def download(args):
     file_name = args.file
+    outname = args.output if args.output else file_name
+    part = outname + ".part"
+    etag_file = part + ".etag"
     token = load_token()
     headers = {}
     if token:
         headers["Authorization"] = f"Bearer {token}"
     params = {"filename": file_name}
-    resp = requests.get(f"{DOWNLOAD_URL}/files/download", params=params, headers=headers, stream=True)
-    if resp.status_code == 200:
-        outname = args.output if args.output else file_name
-        with open(outname, 'wb') as f:
-            for chunk in resp.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"Downloaded to {outname}")
+
+    for attempt in range(args.retries + 1):
+        request_headers = dict(headers)
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        if offset and os.path.exists(etag_file):
+            with open(etag_file) as f:
+                request_headers["Range"] = f"bytes={offset}-"
+                request_headers["If-Range"] = f.read().strip()
+
+        try:
+            resp = requests.get(f"{DOWNLOAD_URL}/files/download", params=params, headers=request_headers, stream=True)
+            if resp.status_code == 416:
+                # nothing past the end of the partial file - it already holds every byte
+                break
+            if resp.status_code not in (200, 206):
+                print("Download failed:", resp.text)  # or use print_response(resp)
+                return
+            if resp.status_code == 206:
+                print(f"Resuming {file_name} from byte {offset}")
+            if "ETag" in resp.headers:
+                with open(etag_file, 'w') as f:
+                    f.write(resp.headers["ETag"])
+            # a 200 is the whole file, so anything already in the partial file is stale
+            with open(part, 'ab' if resp.status_code == 206 else 'wb') as f:
+                for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            break
+        except requests.exceptions.RequestException as e:
+            print(f"Download interrupted: {e}")
+            if attempt < args.retries:
+                time.sleep(1)
     else:
-        print("Download failed:", resp.text)  # or use print_response(resp)
+        print(f"Download failed after {args.retries + 1} attempts - run it again to resume from {part}")
+        return
+
+    os.replace(part, outname)
+    if os.path.exists(etag_file):
+        os.remove(etag_file)
+    print(f"Downloaded to {outname}")
+
+# show how many files and bytes the logged-in user stores - requires token for auth
+def usage(args):
+    headers = {}
+    token = load_token()
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    resp = requests.get(f"{API_URL}/files/usage", headers=headers)
+    print_response(resp)
 
 # delete file from the storage service - requires token for auth
 def delete(args):
@@ -96,15 +175,47 @@ def delete(args):
     else:
         print("Delete failed:", resp.text)  # or use print_response(resp)
 
-# list all files from the metadata service - requires token for auth
+# list files from the metadata service page by page, printing each page as it arrives - requires token for auth
 def list_files(args):
-    params = {}
+    params = {"limit": args.page_size}
+    if args.prefix:
+        params["prefix"] = args.prefix
+    if args.user:
+        params["user"] = args.user
     headers = {}
     token = load_token()
     if token:
         headers["Authorization"] = f"Bearer {token}"
-    resp = requests.get(f"{API_URL}/files", params=params, headers=headers)
-    print_response(resp)
+
+    if args.stream:
+        # one streamed response instead of pages - each file is printed as its line arrives
+        headers["Accept"] = "application/x-ndjson"
+        params.pop("limit")
+        if args.limit is not None:
+            params["limit"] = args.limit
+        resp = requests.get(f"{API_URL}/files", params=params, headers=headers, stream=True)
+        if resp.status_code != 200:
+            print_response(resp)
+            return
+        for line in resp.iter_lines():
+            if line:
+                print(json.loads(line))
+        return
+
+    remaining = args.limit
+    while remaining is None or remaining > 0:
+        resp = requests.get(f"{API_URL}/files", params=params, headers=headers)
+        if resp.status_code != 200:
+            print_response(resp)
+            return
+        page = resp.json()
+        for record in page["files"][:remaining]:
+            print(record)
+        if remaining is not None:
+            remaining -= len(page["files"])
+        if not page["next_cursor"]:
+            return
+        params["cursor"] = page["next_cursor"]
 
 def main():
     parser = argparse.ArgumentParser(description="Mini-Dropbox CLI Client")
@@ -127,16 +238,31 @@ def main():
     parser_upload.add_argument("file")
     parser_upload.set_defaults(func=upload)
 
+    # Batch upload
+    parser_upload_batch = subparsers.add_parser("upload-batch")
+    parser_upload_batch.add_argument("paths", nargs="+", help="Files or directories to upload together")
+    parser_upload_batch.set_defaults(func=upload_batch)
+
     # Download
     parser_download = subparsers.add_parser("download")
     parser_download.add_argument("file")
     parser_download.add_argument("--output", help="Output file name")
+    parser_download.add_argument("--retries", type=int, default=5, help="Reconnects after a dropped connection")
     parser_download.set_defaults(func=download)
 
     # List files
     parser_list = subparsers.add_parser("list")
+    parser_list.add_argument("--prefix", help="only filenames starting with this")
+    parser_list.add_argument("--user", help="only files owned by this user")
+    parser_list.add_argument("--limit", type=int, help="stop after this many files")
+    parser_list.add_argument("--page-size", type=int, default=100, help="files fetched per request")
+    parser_list.add_argument("--stream", action="store_true", help="fetch everything as one NDJSON stream instead of pages")
     parser_list.set_defaults(func=list_files)
 
+    # Usage
+    parser_usage = subparsers.add_parser("usage")
+    parser_usage.set_defaults(func=usage)
+
     # Delete
     parser_upload = subparsers.add_parser("delete")
     parser_upload.add_argument("file")
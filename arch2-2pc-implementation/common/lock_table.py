@@ -0,0 +1,113 @@
+import threading
+import time
+import zlib
+
+
+class Histogram:
+    # counts of durations in milliseconds over fixed log-scale buckets
+    BOUNDS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000, 30000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(self.BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        index = next((i for i, bound in enumerate(self.BOUNDS_MS) if ms <= bound), len(self.BOUNDS_MS))
+        with self.lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def snapshot(self):
+        # buckets are listed in order, the last one (le_ms null) catches everything above the top bound
+        with self.lock:
+            return {
+                "count": self.count,
+                "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+                "max_ms": round(self.max_ms, 3),
+                "buckets": [
+                    {"le_ms": bound, "count": count}
+                    for bound, count in zip(self.BOUNDS_MS + (None,), self.buckets)
+                ]
+            }
+
+
+class LockTable:
+    # exclusive locks keyed by name (e.g. a filename) owned by a transaction until its decision.
+    # keys hash onto a fixed set of stripes so unrelated names never contend on the same mutex
+    def __init__(self, stripes=64, wait_ms=0):
+        self.wait = wait_ms / 1000
+        self.stripes = [threading.Condition() for _ in range(stripes)]
+        self.owners = [{} for _ in range(stripes)]
+        self.wait_histogram = Histogram()
+        self.hold_histogram = Histogram()
+        self.conflicts = 0
+        self.conflicts_lock = threading.Lock()
+
+    def _stripe(self, key):
+        return zlib.crc32(key.encode()) % len(self.stripes)
+
+    def acquire(self, key, txn_id):
+        # returns None once txn_id holds the lock, otherwise the transaction still holding it.
+        # a conflict aborts straight away unless wait_ms allows a bounded wait for the holder to finish
+        stripe = self._stripe(key)
+        cond = self.stripes[stripe]
+        owners = self.owners[stripe]
+        started = time.monotonic()
+        deadline = started + self.wait
+
+        with cond:
+            while True:
+                holder = owners.get(key)
+                if holder is None or holder[0] == txn_id:
+                    if holder is None:
+                        owners[key] = (txn_id, time.monotonic())
+                    self.wait_histogram.record(time.monotonic() - started)
+                    return None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self.conflicts_lock:
+                        self.conflicts += 1
+                    self.wait_histogram.record(time.monotonic() - started)
+                    return holder[0]
+                cond.wait(remaining)
+
+    def release(self, key, txn_id):
+        stripe = self._stripe(key)
+        cond = self.stripes[stripe]
+        owners = self.owners[stripe]
+
+        with cond:
+            holder = owners.get(key)
+            if holder is None or holder[0] != txn_id:
+                return False
+            del owners[key]
+            self.hold_histogram.record(time.monotonic() - holder[1])
+            cond.notify_all()
+            return True
+
+    def holder(self, key):
+        stripe = self._stripe(key)
+        with self.stripes[stripe]:
+            holder = self.owners[stripe].get(key)
+        return holder[0] if holder is not None else None
+
+    def stats(self):
+        held = 0
+        for cond, owners in zip(self.stripes, self.owners):
+            with cond:
+                held += len(owners)
+        return {
+            "stripes": len(self.stripes),
+            "wait_ms": self.wait * 1000,
+            "held": held,
+            "conflicts": self.conflicts,
+            "lock_wait": self.wait_histogram.snapshot(),
+            "lock_hold": self.hold_histogram.snapshot()
+        }
@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import grpc
+import twopc_pb2
+import twopc_pb2_grpc
+
+COMPLETED_TXN_LIMIT = int(os.environ.get("COMPLETED_TXN_LIMIT", "10000")) # resolved transactions remembered for idempotent decisions
+COMMIT_PROTOCOL = os.environ.get("COMMIT_PROTOCOL", "presumed_nothing") # "presumed_nothing" or "presumed_abort" - must match the coordinator
+PREPARED_TIMEOUT = float(os.environ.get("PREPARED_TIMEOUT", "60")) # seconds a prepared transaction waits for its decision before asking for the outcome
+REAPER_INTERVAL = float(os.environ.get("REAPER_INTERVAL", "10")) # seconds between sweeps for timed-out prepared transactions
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", "5")) # deadline (seconds) for each QueryDecision call
+COORDINATOR_ADDR = os.environ.get("COORDINATOR_ADDR", "upload:50051") # asked first about a timed-out transaction
+PEERS = os.environ.get("PEERS", "2=storage1:50052,3=storage2:50053,4=metadata1:50054,5=metadata2:50055") # every participant as node_id=host:port, asked when the coordinator is unreachable
+READ_ONLY = "read_only" # remembered for transactions this node voted read-only on - it never learns their outcome
+
+
+def batch_vote(votes, atomic):
+    # one vote for the whole batch: read-only only if every file is, and an abort aborts it -
+    # though a non-atomic batch only aborts outright once every file has
+    aborted = sum(1 for v in votes if v.vote == twopc_pb2.VOTE_ABORT)
+    if aborted and (atomic or aborted == len(votes)):
+        return twopc_pb2.VOTE_ABORT
+    if all(v.vote == twopc_pb2.VOTE_READ_ONLY for v in votes):
+        return twopc_pb2.VOTE_READ_ONLY
+    return twopc_pb2.VOTE_COMMIT
+
+
+class Participant:
+    # outcome bookkeeping, decision handling and cooperative termination shared by the storage and metadata nodes.
+    # prepared_transactions holds what the node has voted to commit, each entry with its 'prepared_at'.
+    # subclasses vote in VoteRequest, make a decision take effect in apply_decision and free what a prepared
+    # transaction holds in release_prepared
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.prepared_transactions = {}
+        self.completed_transactions = OrderedDict()
+        self.completed_lock = threading.Lock()
+        self.query_stubs = {}
+        self.peers = {}
+        for peer in PEERS.split(","):
+            peer_id, _, address = peer.strip().partition("=")
+            if address and peer_id != node_id:
+                self.peers[peer_id] = address
+
+    def _record(self, txn_id, decision):
+        # completed_lock must be held
+        self.completed_transactions[txn_id] = decision
+        while len(self.completed_transactions) > COMPLETED_TXN_LIMIT:
+            self.completed_transactions.popitem(last=False)
+
+    def remember_outcome(self, txn_id, decision):
+        # keep recent outcomes so a retried GlobalDecision is acknowledged instead of failing
+        with self.completed_lock:
+            self._record(txn_id, decision)
+
+    def claim(self, txn_id, decision):
+        # takes a prepared transaction out to apply its decision, or None if it is not prepared here.
+        # the outcome is recorded in the same step, so a query arriving while the decision is still being
+        # applied gets the answer - it never finds the transaction neither prepared nor decided, and aborts it.
+        # taking it out also keeps a decision retried while the first is still running from being applied twice
+        with self.completed_lock:
+            txn = self.prepared_transactions.pop(txn_id, None)
+            if txn is not None:
+                self._record(txn_id, decision)
+            return txn
+
+    def applied(self, txn_id, decision):
+        # under presumed abort only commits need remembering - a forgotten transaction reads as aborted
+        if decision != twopc_pb2.GLOBAL_COMMIT and COMMIT_PROTOCOL == "presumed_abort":
+            with self.completed_lock:
+                self.completed_transactions.pop(txn_id, None)
+
+    def unclaim(self, txn_id, txn):
+        # applying the decision failed - prepared again so a retry can apply it, the outcome stays known
+        with self.completed_lock:
+            self.prepared_transactions[txn_id] = txn
+
+    def apply_decision(self, txn_id, txn, decision):
+        # makes the decision take effect on this node - raising leaves the transaction prepared for a retry
+        raise NotImplementedError
+
+    def release_prepared(self, txn_id, txn):
+        # frees what the transaction held while prepared, once it is decided or its batch is rolled back
+        raise NotImplementedError
+
+    def BatchVoteRequest(self, request, context):
+        caller_node_id = "1"
+        print(f"\nPhase Voting of Node {self.node_id} receives RPC BatchVoteRequest from Phase Voting of Node {caller_node_id}")
+        print(f"[Node {self.node_id}] Batch ID: {request.batch_id} ({len(request.requests)} files, atomic={request.atomic})")
+
+        votes = []
+        for vote_request in request.requests:
+            response = self.VoteRequest(vote_request, context)
+            votes.append(response)
+            if request.atomic and response.vote == twopc_pb2.VOTE_ABORT:
+                break
+
+        aborted = next((v for v in votes if v.vote == twopc_pb2.VOTE_ABORT), None)
+        if request.atomic and aborted is not None:
+            # the batch cannot commit, so release what was already prepared and abort the rest unseen
+            for vote in votes:
+                txn = self.prepared_transactions.pop(vote.transaction_id, None)
+                if txn is not None:
+                    self.release_prepared(vote.transaction_id, txn)
+            votes = [
+                twopc_pb2.VoteResponse(
+                    transaction_id=vote_request.transaction_id,
+                    vote=twopc_pb2.VOTE_ABORT,
+                    node_id=self.node_id,
+                    reason=f"Batch aborted: {aborted.reason}"
+                )
+                for vote_request in request.requests
+            ]
+
+        return twopc_pb2.BatchVoteResponse(
+            batch_id=request.batch_id,
+            vote=batch_vote(votes, request.atomic),
+            node_id=self.node_id,
+            reason=aborted.reason if aborted is not None else "",
+            votes=votes
+        )
+
+    def GlobalDecision(self, request, context):
+        caller_node_id = "1"
+        print(f"\nPhase Decision of Node {self.node_id} receives RPC GlobalDecision from Phase Decision of Node {caller_node_id}")
+
+        txn_id = request.transaction_id
+        decision = request.decision
+
+        decision_str = "GLOBAL_COMMIT" if decision == twopc_pb2.GLOBAL_COMMIT else "GLOBAL_ABORT"
+        print(f"[Node {self.node_id}] Transaction ID: {txn_id}")
+        print(f"[Node {self.node_id}] Decision: {decision_str}")
+
+        txn = self.claim(txn_id, decision)
+        if txn is None:
+            # a retried decision for an already resolved transaction, or an abort for one that never prepared
+            # (under presumed abort no record at all means the transaction aborted)
+            outcome = self.completed_transactions.get(txn_id)
+            success = outcome == decision or (outcome is None and decision == twopc_pb2.GLOBAL_ABORT)
+            print(f"[Node {self.node_id}] Transaction not found in prepared state")
+            return twopc_pb2.DecisionAck(
+                transaction_id=txn_id,
+                node_id=self.node_id,
+                success=success
+            )
+
+        try:
+            self.apply_decision(txn_id, txn, decision)
+            self.applied(txn_id, decision)
+            self.release_prepared(txn_id, txn)
+
+            return twopc_pb2.DecisionAck(
+                transaction_id=txn_id,
+                node_id=self.node_id,
+                success=True
+            )
+        except Exception as e:
+            print(f"[Node {self.node_id}] Error during {decision_str}: {e}")
+            self.unclaim(txn_id, txn)
+            return twopc_pb2.DecisionAck(
+                transaction_id=txn_id,
+                node_id=self.node_id,
+                success=False
+            )
+
+    def BatchGlobalDecision(self, request, context):
+        acks = [self.GlobalDecision(decision, context) for decision in request.decisions]
+        return twopc_pb2.BatchDecisionAck(
+            batch_id=request.batch_id,
+            node_id=self.node_id,
+            success=all(ack.success for ack in acks),
+            acks=acks
+        )
+
+    def DecisionStream(self, request_iterator, context):
+        # the coordinator keeps this stream open - every batch of decisions gets its acks back in order
+        for batch in request_iterator:
+            yield self.BatchGlobalDecision(batch, context)
+
+    def QueryDecision(self, request, context):
+        txn_id = request.transaction_id
+        print(f"\nNode {self.node_id} receives RPC QueryDecision for {txn_id} from Node {request.node_id}")
+
+        with self.completed_lock:
+            outcome = self.completed_transactions.get(txn_id)
+            if outcome in (twopc_pb2.GLOBAL_COMMIT, twopc_pb2.GLOBAL_ABORT):
+                state = twopc_pb2.STATE_COMMITTED if outcome == twopc_pb2.GLOBAL_COMMIT else twopc_pb2.STATE_ABORTED
+            else:
+                # prepared, voted read-only, never voted, or an outcome already evicted from
+                # completed_transactions - none of them proves the transaction did not commit elsewhere
+                state = twopc_pb2.STATE_UNKNOWN
+
+        print(f"[Node {self.node_id}] Answering {twopc_pb2.TransactionState.Name(state)}")
+        return twopc_pb2.DecisionStatus(transaction_id=txn_id, state=state, node_id=self.node_id)
+
+    def query(self, address, txn_id):
+        # the state another node reports for txn_id, or None if it cannot be reached
+        stub = self.query_stubs.get(address)
+        if stub is None:
+            stub = twopc_pb2_grpc.TwoPhaseCommitStub(grpc.insecure_channel(address))
+            self.query_stubs[address] = stub
+        try:
+            query = twopc_pb2.DecisionQuery(transaction_id=txn_id, node_id=self.node_id)
+            return stub.QueryDecision(query, timeout=QUERY_TIMEOUT).state
+        except grpc.RpcError as e:
+            print(f"[Node {self.node_id}] QueryDecision to {address} failed: {e.code()}")
+            return None
+
+    def terminate(self, txn_id):
+        # cooperative termination: the coordinator knows best, any participant that has learned or
+        # unilaterally taken the outcome is just as good once the coordinator cannot be reached
+        print(f"[Node {self.node_id}] Transaction {txn_id} prepared for over {PREPARED_TIMEOUT:g}s - asking for its outcome")
+
+        state = self.query(COORDINATOR_ADDR, txn_id)
+        if state is None:
+            for peer_id, address in self.peers.items():
+                state = self.query(address, txn_id)
+                if state in (twopc_pb2.STATE_COMMITTED, twopc_pb2.STATE_ABORTED):
+                    print(f"[Node {self.node_id}] Node {peer_id} knows the outcome of {txn_id}")
+                    break
+
+        if state not in (twopc_pb2.STATE_COMMITTED, twopc_pb2.STATE_ABORTED):
+            print(f"[Node {self.node_id}] Outcome of {txn_id} still unknown - staying prepared")
+            return
+
+        decision = twopc_pb2.GLOBAL_COMMIT if state == twopc_pb2.STATE_COMMITTED else twopc_pb2.GLOBAL_ABORT
+        self.GlobalDecision(twopc_pb2.DecisionMsg(transaction_id=txn_id, decision=decision), None)
+
+    def reap(self):
+        # background sweep so transactions orphaned by a dead coordinator do not pile up
+        while True:
+            time.sleep(REAPER_INTERVAL)
+            self.sweep()
+
+    def sweep(self):
+        now = time.monotonic()
+        for txn_id, txn in list(self.prepared_transactions.items()):
+            if now - txn['prepared_at'] >= PREPARED_TIMEOUT:
+                self.terminate(txn_id)
@@ -1,23 +1,44 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import grpc
 from concurrent import futures
-import os, sys, threading
+import os, sys, threading, time, base64, binascii, json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None # MessagePack listings are refused with 406 without it
 
 sys.path.insert(0, '/app/proto')
 import twopc_pb2
 import twopc_pb2_grpc
 
-app = Flask(__name__)
+sys.path.insert(0, '/app/common')
+from lock_table import LockTable
+from participant import Participant, READ_ONLY
+from store import open_store
 
-# In-memory metadata store
-FILES = {}
-USERS = {}
+app = Flask(__name__)
 
-class MetadataParticipant(twopc_pb2_grpc.TwoPhaseCommitServicer):
+METADATA_STORE = os.environ.get("METADATA_STORE", "sqlite") # "sqlite", "logged" (in memory, recovered from a log and snapshots) or "memory"
+METADATA_DB_PATH = os.environ.get("METADATA_DB_PATH", "/metadata/metadata.db") # SQLite database file
+METADATA_SYNC = os.environ.get("METADATA_SYNC", "FULL") # SQLite synchronous pragma - FULL makes every commit durable before it is acknowledged, OFF also skips the log fsync
+METADATA_LOG_DIR = os.environ.get("METADATA_LOG_DIR", "/metadata/log") # log segments and snapshots of the "logged" store
+METADATA_SNAPSHOT_EVERY = int(os.environ.get("METADATA_SNAPSHOT_EVERY", "100000")) # logged changes between snapshots - bounds how much a restart replays
+METADATA_DB_POOL = int(os.environ.get("METADATA_DB_POOL", "8")) # SQLite connections kept open and shared by all request threads
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "100")) # files per GET /files page when no limit is given
+LIST_MAX_PAGE_SIZE = int(os.environ.get("LIST_MAX_PAGE_SIZE", "1000")) # largest limit GET /files accepts
+LIST_STREAM_BATCH = int(os.environ.get("LIST_STREAM_BATCH", "1000")) # records read from the store and sent per chunk of a streamed listing
+NDJSON = "application/x-ndjson"
+MSGPACK = "application/x-msgpack"
+LOCK_STRIPES = int(os.environ.get("LOCK_STRIPES", "64")) # mutexes the filename lock table is striped over
+LOCK_WAIT_MS = float(os.environ.get("LOCK_WAIT_MS", "0")) # how long a prepare waits for a filename held by another transaction, 0 aborts at once
+
+class MetadataParticipant(Participant, twopc_pb2_grpc.TwoPhaseCommitServicer, twopc_pb2_grpc.DecisionChannelServicer):
     def __init__(self, node_id):
-        self.node_id = node_id
-        self.files = FILES
-        self.prepared_transactions = {}
+        super().__init__(node_id)
+        self.store = store
+        # a prepared transaction holds its filename until the decision arrives
+        self.locks = LockTable(stripes=LOCK_STRIPES, wait_ms=LOCK_WAIT_MS)
 
     def VoteRequest(self, request, context):
         caller_node_id = "1"
@@ -35,19 +56,49 @@ class MetadataParticipant(twopc_pb2_grpc.TwoPhaseCommitServicer):
         try:
             if not metadata.filename or len(metadata.filename) == 0:
                 raise ValueError("Invalid filename")
-            
-            if metadata.filename in self.files:
-                raise ValueError(f"File '{metadata.filename}' already exists")
-            
+
             if metadata.size <= 0:
                 raise ValueError("Invalid file size")
-            
-            self.prepared_transactions[txn_id] = {
-                'filename': metadata.filename,
-                'size': metadata.size,
-                'user': metadata.user,
-                'operation': request.operation
-            }
+
+            # taken before looking at the file table so a concurrent prepare of the same name cannot slip in
+            holder = self.locks.acquire(metadata.filename, txn_id)
+            if holder is not None:
+                raise ValueError(f"File '{metadata.filename}' is locked by transaction {holder}")
+
+            existing = self.store.get_file(metadata.filename)
+            if (existing is not None and metadata.checksum
+                    and existing.get('checksum') == metadata.checksum
+                    and existing['user'] == metadata.user and existing['size'] == metadata.size):
+                # an identical re-upload - the record already says exactly this, so nothing to commit
+                print(f"[Node {self.node_id}] Metadata for '{metadata.filename}' is already up to date")
+                print(f"[Node {self.node_id}] Voting: VOTE_READ_ONLY")
+                self.locks.release(metadata.filename, txn_id)
+                self.remember_outcome(txn_id, READ_ONLY)
+                return twopc_pb2.VoteResponse(
+                    transaction_id=txn_id,
+                    vote=twopc_pb2.VOTE_READ_ONLY,
+                    node_id=self.node_id
+                )
+
+            if existing is not None:
+                raise ValueError(f"File '{metadata.filename}' already exists")
+
+            # the coordinator cancels outstanding votes once another node votes abort
+            if not context.is_active():
+                raise ValueError("VoteRequest cancelled by coordinator")
+
+            with self.completed_lock:
+                # a vote request arriving late, after this node already applied the abort, must not prepare it again
+                if self.completed_transactions.get(txn_id) == twopc_pb2.GLOBAL_ABORT:
+                    raise ValueError("Transaction already aborted")
+                self.prepared_transactions[txn_id] = {
+                    'filename': metadata.filename,
+                    'size': metadata.size,
+                    'user': metadata.user,
+                    'checksum': metadata.checksum,
+                    'operation': request.operation,
+                    'prepared_at': time.monotonic()
+                }
 
             print(f"[Node {self.node_id}] Metadata validation passed")
             print(f"[Node {self.node_id}] Voting: VOTE_COMMIT")
@@ -61,6 +112,9 @@ class MetadataParticipant(twopc_pb2_grpc.TwoPhaseCommitServicer):
             print(f"[Node {self.node_id}] Validation failed: {e}")
             print(f"[Node {self.node_id}] Voting: VOTE_ABORT")
 
+            if txn_id not in self.prepared_transactions:
+                self.locks.release(metadata.filename, txn_id)
+
             return twopc_pb2.VoteResponse(
                 transaction_id=txn_id,
                 vote=twopc_pb2.VOTE_ABORT,
@@ -68,54 +122,34 @@ class MetadataParticipant(twopc_pb2_grpc.TwoPhaseCommitServicer):
                 reason=str(e)
             )
 
-    def GlobalDecision(self, request, context):
-        caller_node_id = "1"
-        print(f"\nPhase Decision of Node {self.node_id} recevies RPC GlobalDecision from Phase Decision of Node {caller_node_id}")
-
-        txn_id = request.transaction_id
-        decision = request.decision
-
-        decision_str = "GLOBAL_COMMIT" if decision == twopc_pb2.GLOBAL_COMMIT else "GLOBAL_ABORT"
-        print(f"[Node {self.node_id}] Transaction ID: {txn_id}")
-        print(f"[Node {self.node_id}] Decision: {decision_str}")
-
-        if txn_id not in self.prepared_transactions:
-            print(f"[Node {self.node_id}] Transaction not found in prepared state")
-            return twopc_pb2.DecisionAck(
-                transaction_id=txn_id,
-                node_id=self.node_id,
-                success=False
-            )
-        metadata = self.prepared_transactions[txn_id]
-
-        try:
-            if decision == twopc_pb2.GLOBAL_COMMIT:
-                self.files[metadata['filename']] = {
-                    'filename': metadata['filename'],
-                    'size': metadata['size'],
-                    'user': metadata['user'],
-                    'path': f"/storage/{metadata['filename']}",
-                    'version': 1
-                }
-                print(f"[Node {self.node_id}] COMMITED: Metadata saved for {metadata['filename']}")
-            else:
-                print(f"[Node {self.node_id}] ABORTED: Discarded metadata for {metadata['filename']}")
-            
-            del self.prepared_transactions[txn_id]
-
-            return twopc_pb2.DecisionAck(
-                transaction_id=txn_id,
-                node_id=self.node_id,
-                success=True
-            )
-        except Exception as e:
-            print(f"[Node {self.node_id}] Error during {decision_str}: {e}")
-            return twopc_pb2.DecisionAck(
-                transaction_id=txn_id,
-                node_id=self.node_id,
-                success=False
-            )
-        
+    def VoteRequestStream(self, request_iterator, context):
+        header = next(request_iterator).header
+
+        # only the header matters here - the file bytes are dropped as they arrive
+        for _ in request_iterator:
+            pass
+
+        return self.VoteRequest(header, context)
+
+    def apply_decision(self, txn_id, metadata, decision):
+        if decision == twopc_pb2.GLOBAL_COMMIT:
+            # written through to the store before the commit is acknowledged
+            self.store.put_file({
+                'filename': metadata['filename'],
+                'size': metadata['size'],
+                'user': metadata['user'],
+                'checksum': metadata['checksum'],
+                'path': f"/storage/{metadata['filename']}",
+                'version': 1
+            })
+            print(f"[Node {self.node_id}] COMMITED: Metadata saved for {metadata['filename']}")
+        else:
+            print(f"[Node {self.node_id}] ABORTED: Discarded metadata for {metadata['filename']}")
+
+    def release_prepared(self, txn_id, metadata):
+        self.locks.release(metadata['filename'], txn_id)
+
+store = open_store(METADATA_STORE, METADATA_DB_PATH, METADATA_SYNC, METADATA_LOG_DIR, METADATA_SNAPSHOT_EVERY, METADATA_DB_POOL)
 metadata_participant = None
 
 def serve_grpc(node_id, port):
@@ -125,6 +159,8 @@ def serve_grpc(node_id, port):
 
     metadata_participant = MetadataParticipant(node_id)
     twopc_pb2_grpc.add_TwoPhaseCommitServicer_to_server(metadata_participant, server)
+    twopc_pb2_grpc.add_DecisionChannelServicer_to_server(metadata_participant, server)
+    threading.Thread(target=metadata_participant.reap, daemon=True).start()
 
     server.add_insecure_port(f'[::]:{port}')
     server.start()
@@ -190,26 +226,86 @@ def add_user():
     if not username or not password:
         return jsonify({"error": "Missing username or password"}), 400
 
-    if username in USERS:
+    if not store.add_user(username, password):
         return jsonify({"error": "Username already exists"}), 409
 
-    USERS[username] = password
     return jsonify({"message": "User created"}), 201
 
 # ---------------- Get User for Login ----------------
 @app.route("/users/<username>", methods=["GET"])
 def get_user(username):
-    if username not in USERS:
+    password = store.get_user(username)
+    if password is None:
         return jsonify({"error": "User not found"}), 404
     return jsonify({
         "username": username,
-        "password": USERS[username]
+        "password": password
     }), 200
 
-# ---------------- List All Files (Optional) ----------------
+# ---------------- User Usage ----------------
+@app.route("/users/<username>/usage", methods=["GET"])
+def get_usage(username):
+    # running counters kept by the store at commit time - no scan of the user's files
+    usage = store.get_usage(username)
+    return jsonify({"username": username, "files": usage["files"], "bytes": usage["bytes"]}), 200
+
+# ---------------- List Files ----------------
+# cursors are the last filename of the previous page, opaque to clients
+def encode_cursor(filename):
+    return base64.urlsafe_b64encode(filename.encode()).decode()
+
+def decode_cursor(cursor):
+    return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+
+def stream_files(after, prefix, user, limit, mode):
+    # walks the store a batch at a time, so neither the full list nor the full response is ever built
+    sent = 0
+    while limit is None or sent < limit:
+        batch = LIST_STREAM_BATCH if limit is None else min(LIST_STREAM_BATCH, limit - sent)
+        records = store.list_files(batch, after, prefix, user)
+        if mode == NDJSON:
+            yield "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        else:
+            yield b"".join(msgpack.packb(record) for record in records)
+
+        sent += len(records)
+        if len(records) < batch:
+            return
+        after = records[-1]['filename']
+
 @app.route("/files", methods=["GET"])
 def list_files():
-    return jsonify(list(FILES.values())), 200
+    # one page in filename order - next_cursor, passed back as cursor, fetches the page after it.
+    # Accept: application/x-ndjson or application/x-msgpack streams every matching record instead
+    # (up to limit, if given), one JSON line or MessagePack map per file
+    mode = request.accept_mimetypes.best_match(["application/json", NDJSON, MSGPACK]) or "application/json"
+    if mode == MSGPACK and msgpack is None:
+        return jsonify({"error": "MessagePack is not available on this node"}), 406
+
+    try:
+        if mode == "application/json":
+            limit = min(max(int(request.args.get("limit", LIST_PAGE_SIZE)), 1), LIST_MAX_PAGE_SIZE)
+        else:
+            limit = max(int(request.args["limit"]), 0) if "limit" in request.args else None
+        after = decode_cursor(request.args.get("cursor", ""))
+    except (ValueError, binascii.Error):
+        return jsonify({"error": "Invalid limit or cursor"}), 400
+
+    if mode != "application/json":
+        return Response(stream_files(after, request.args.get("prefix", ""), request.args.get("user"), limit, mode), mimetype=mode)
+
+    # one extra record tells whether another page follows
+    records = store.list_files(limit + 1, after, request.args.get("prefix", ""), request.args.get("user"))
+    next_cursor = encode_cursor(records[limit - 1]['filename']) if len(records) > limit else None
+    return jsonify({"files": records[:limit], "next_cursor": next_cursor}), 200
+
+# ---------------- Lock Stats ----------------
+@app.route("/locks/stats", methods=["GET"])
+def lock_stats():
+    # lock-wait and lock-hold histograms of the filename lock table
+    if metadata_participant is None:
+        return jsonify({"error": "gRPC server not started"}), 503
+    return jsonify(metadata_participant.locks.stats()), 200
 
 # ---------------- Main ----------------
 if __name__ == "__main__":
@@ -0,0 +1,448 @@
+import bisect
+import contextlib
+import gc
+import json
+import os
+import pickle
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+FILE_COLUMNS = ("filename", "user", "size", "checksum", "path", "version")
+
+
+def file_record(filename, user, size, checksum, path, version):
+    return {"filename": filename, "user": user, "size": size, "checksum": checksum, "path": path, "version": version}
+
+
+class FileRecord:
+    # how the in-memory stores hold a file: slots instead of a dict, the owner's name interned so all
+    # of a user's records share one string, a hex checksum as its 32 raw bytes, and the path only when
+    # it is not the usual /storage/<filename>. the stores hand out plain dicts built from it
+    __slots__ = ("filename", "user", "size", "digest", "custom_path", "version")
+
+    def __init__(self, filename, user, size, checksum, path, version):
+        self.filename = filename
+        self.user = sys.intern(user)
+        self.size = size
+        try:
+            self.digest = bytes.fromhex(checksum) if len(checksum) == 64 else checksum
+        except ValueError:
+            self.digest = checksum
+        self.custom_path = None if path == f"/storage/{filename}" else path
+        self.version = version
+
+    def row(self):
+        checksum = self.digest.hex() if isinstance(self.digest, bytes) else self.digest
+        path = self.custom_path if self.custom_path is not None else f"/storage/{self.filename}"
+        return (self.filename, self.user, self.size, checksum, path, self.version)
+
+    def to_dict(self):
+        return file_record(*self.row())
+
+
+def prefix_end(prefix):
+    # the smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class MemoryStore:
+    # FileRecords in a dict - fast, but gone on restart. names keeps every filename sorted for listings,
+    # user_names the same per owner, and usage a running [files, bytes] per owner
+    def __init__(self):
+        self.files = {}
+        self.names = []
+        self.user_names = {}
+        self.usage = {}
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def get_file(self, filename):
+        record = self.files.get(filename)
+        return record.to_dict() if record is not None else None
+
+    def put_file(self, record):
+        with self.lock:
+            self._put(FileRecord(*(record[column] for column in FILE_COLUMNS)))
+
+    def _put(self, record):
+        # caller holds lock - the record and every index over it change together
+        filename = record.filename
+        old = self.files.get(filename)
+        if old is None:
+            bisect.insort(self.names, filename)
+        else:
+            self._unindex(old)
+        self.files[filename] = record
+        self._index(record)
+
+    def _index(self, record):
+        bisect.insort(self.user_names.setdefault(record.user, []), record.filename)
+        usage = self.usage.setdefault(record.user, [0, 0])
+        usage[0] += 1
+        usage[1] += record.size
+
+    def _unindex(self, record):
+        names = self.user_names[record.user]
+        del names[bisect.bisect_left(names, record.filename)]
+        usage = self.usage[record.user]
+        usage[0] -= 1
+        usage[1] -= record.size
+
+    def _rebuild_indexes(self):
+        # after a bulk load - one pass over the records instead of an insort each
+        self.names = sorted(self.files)
+        self.user_names = {}
+        self.usage = {}
+        for filename in self.names:
+            record = self.files[filename]
+            self.user_names.setdefault(record.user, []).append(filename)
+            usage = self.usage.setdefault(record.user, [0, 0])
+            usage[0] += 1
+            usage[1] += record.size
+
+    def list_files(self, limit, after="", prefix="", user=None):
+        # up to limit records in filename order, after the cursor and matching the filters -
+        # a user filter walks only that user's names
+        with self.lock:
+            names = self.names if user is None else self.user_names.get(user, [])
+            if after >= prefix:
+                i = bisect.bisect_right(names, after)
+            else:
+                i = bisect.bisect_left(names, prefix)
+
+            records = []
+            while i < len(names) and len(records) < limit and names[i].startswith(prefix):
+                records.append(self.files[names[i]].to_dict())
+                i += 1
+            return records
+
+    def get_usage(self, user):
+        files, size = self.usage.get(user, (0, 0))
+        return {"files": files, "bytes": size}
+
+    def add_user(self, username, password):
+        # False if the name is taken
+        with self.lock:
+            if username in self.users:
+                return False
+            self.users[username] = password
+            return True
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def close(self):
+        pass
+
+
+class LoggedStore(MemoryStore):
+    # a MemoryStore made durable: every change is appended to a log before it is applied, and the whole
+    # state is periodically written out as a snapshot so a restart only replays the log after it.
+    # wal.N holds the changes made after snapshot.N was taken
+    def __init__(self, directory, snapshot_every=100000, sync=True):
+        super().__init__()
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.sync = sync
+        self.write_lock = threading.Lock()
+        self.snapshotting = False
+        self.logged = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.segment = self._recover()
+        self.log = open(self._path("wal", self.segment), "ab")
+
+    def _path(self, kind, seq):
+        return os.path.join(self.directory, f"{kind}.{seq:08d}")
+
+    def _segments(self, kind):
+        # an unfinished snapshot.N.tmp does not count
+        seqs = []
+        for name in os.listdir(self.directory):
+            prefix, _, seq = name.partition(".")
+            if prefix == kind and seq.isdigit():
+                seqs.append(int(seq))
+        return sorted(seqs)
+
+    def _recover(self):
+        started = time.monotonic()
+        snapshots = self._segments("snapshot")
+        latest = snapshots[-1] if snapshots else 0
+        segments = [seq for seq in self._segments("wal") if seq >= latest]
+        replayed = 0
+
+        # millions of new records would otherwise trigger collection after collection while loading
+        gc.disable()
+        try:
+            if latest:
+                with open(self._path("snapshot", latest), "rb") as f:
+                    rows, self.users = pickle.load(f)
+                self.files = {row[0]: FileRecord(*row) for row in rows}
+                del rows
+            for seq in segments:
+                replayed += self._replay(self._path("wal", seq))
+            self._rebuild_indexes()
+        finally:
+            gc.enable()
+        # the loaded records live as long as the process - keep them out of future collections
+        gc.freeze()
+
+        print(f"[LoggedStore] Loaded {len(self.files)} files from snapshot {latest} and {replayed} log records "
+              f"in {time.monotonic() - started:.2f}s")
+        return segments[-1] if segments else max(latest, 1)
+
+    def _replay(self, path):
+        with open(path, "rb+") as f:
+            data = f.read()
+            valid = data.rfind(b"\n") + 1
+            if valid != len(data):
+                # a crash mid-append leaves a partial last record - cut it so appends start on a fresh line
+                print(f"[LoggedStore] Dropping {len(data) - valid} bytes of torn record from {path}")
+                f.truncate(valid)
+        if not valid:
+            return 0
+
+        # one JSON array for the whole segment parses far faster than a json.loads per line
+        # (newlines inside records are always escaped)
+        records = json.loads(b"[" + data[:valid - 1].replace(b"\n", b",") + b"]")
+        for record in records:
+            if record[0] == "f":
+                self.files[record[1]] = FileRecord(*record[1:])
+            else:
+                self.users[record[1]] = record[2]
+        return len(records)
+
+    def _append(self, record):
+        # caller holds write_lock - the change is on disk before it is applied in memory
+        self.log.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+        self.log.flush()
+        if self.sync:
+            os.fsync(self.log.fileno())
+
+    def _applied(self):
+        # caller holds write_lock, with the logged change applied - a snapshot taken now includes it
+        self.logged += 1
+        if self.logged >= self.snapshot_every and not self.snapshotting:
+            self._rotate()
+
+    def _rotate(self):
+        # start a fresh log segment and snapshot the state as of its start, off the commit path
+        self.log.close()
+        self.segment += 1
+        self.log = open(self._path("wal", self.segment), "ab")
+        self.logged = 0
+        self.snapshotting = True
+
+        # records are never modified once stored, so a shallow copy is a consistent picture
+        files = dict(self.files)
+        users = dict(self.users)
+        threading.Thread(target=self._snapshot, args=(self.segment, files, users), daemon=True).start()
+
+    def _snapshot(self, seq, files, users):
+        try:
+            started = time.monotonic()
+            rows = [record.row() for record in files.values()]
+            path = self._path("snapshot", seq)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump((rows, users), f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            dir_fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+            # everything before this snapshot is now redundant
+            for kind in ("snapshot", "wal"):
+                for old in self._segments(kind):
+                    if old < seq:
+                        os.remove(self._path(kind, old))
+            print(f"[LoggedStore] Wrote snapshot {seq} ({len(rows)} files) in {time.monotonic() - started:.2f}s")
+        except OSError as e:
+            print(f"[LoggedStore] Snapshot {seq} failed: {e}")
+        finally:
+            with self.write_lock:
+                self.snapshotting = False
+
+    def put_file(self, record):
+        with self.write_lock:
+            self._append(["f"] + [record[column] for column in FILE_COLUMNS])
+            with self.lock:
+                self._put(FileRecord(*(record[column] for column in FILE_COLUMNS)))
+            self._applied()
+
+    def add_user(self, username, password):
+        with self.write_lock:
+            if username in self.users:
+                return False
+            self._append(["u", username, password])
+            with self.lock:
+                self.users[username] = password
+            self._applied()
+            return True
+
+    def close(self):
+        with self.write_lock:
+            self.log.close()
+
+
+class SQLiteStore:
+    # files and users in one SQLite database in WAL mode - readers never block the committing writer.
+    # each call borrows a connection from a small pool and hands it back, so connections (and the fixed
+    # SQL below, compiled once per connection into its statement cache) outlive the short-lived threads
+    # the HTTP server runs requests on
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS files (
+            filename TEXT PRIMARY KEY,
+            user TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            path TEXT NOT NULL,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS files_user ON files (user, filename)",
+        """CREATE TABLE IF NOT EXISTS usage (
+            user TEXT PRIMARY KEY,
+            files INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        ) WITHOUT ROWID""",
+        """CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL
+        ) WITHOUT ROWID"""
+    ]
+
+    GET_FILE = "SELECT filename, user, size, checksum, path, version FROM files WHERE filename = ?"
+    PUT_FILE = "INSERT OR REPLACE INTO files (filename, user, size, checksum, path, version) VALUES (?, ?, ?, ?, ?, ?)"
+    SELECT_FILES = "SELECT filename, user, size, checksum, path, version FROM files"
+    ADD_USAGE = """INSERT INTO usage (user, files, bytes) VALUES (?, ?, ?)
+        ON CONFLICT (user) DO UPDATE SET files = files + excluded.files, bytes = bytes + excluded.bytes"""
+    GET_USAGE = "SELECT files, bytes FROM usage WHERE user = ?"
+    # a database from before the usage table gets its counters from one scan
+    BACKFILL_USAGE = "INSERT INTO usage (user, files, bytes) SELECT user, COUNT(*), SUM(size) FROM files GROUP BY user"
+    ADD_USER = "INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)"
+    GET_USER = "SELECT password FROM users WHERE username = ?"
+
+    def __init__(self, path, synchronous="FULL", cache_kib=65536, pool_size=8):
+        self.path = path
+        self.synchronous = synchronous
+        self.cache_kib = cache_kib
+        self.pool_size = pool_size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.pool_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+                if conn.execute("SELECT COUNT(*) FROM usage").fetchone()[0] == 0:
+                    conn.execute(self.BACKFILL_USAGE)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, cached_statements=64, check_same_thread=False)
+        # FULL makes a commit durable before GlobalDecision is acknowledged
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_kib}")
+        return conn
+
+    @contextlib.contextmanager
+    def _conn(self):
+        # the most recently returned connection (warmest cache) - a new one only while fewer than
+        # pool_size are open, otherwise wait for one to come back
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.pool_lock:
+                grow = self.opened < self.pool_size
+                if grow:
+                    self.opened += 1
+            if grow:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self.pool_lock:
+                        self.opened -= 1
+                    raise
+            else:
+                conn = self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def _record(self, row):
+        return file_record(*row) if row is not None else None
+
+    def get_file(self, filename):
+        with self._conn() as conn:
+            return self._record(conn.execute(self.GET_FILE, (filename,)).fetchone())
+
+    def put_file(self, record):
+        # one transaction per call, usage counters included - committed (and synced) by the time this returns
+        with self._conn() as conn, conn:
+            # the read of the old record belongs to the same write transaction
+            conn.execute("BEGIN IMMEDIATE")
+            old = conn.execute(self.GET_FILE, (record['filename'],)).fetchone()
+            if old is not None:
+                conn.execute(self.ADD_USAGE, (old[1], -1, -old[2]))
+            conn.execute(self.PUT_FILE, tuple(record[column] for column in FILE_COLUMNS))
+            conn.execute(self.ADD_USAGE, (record['user'], 1, record['size']))
+
+    def list_files(self, limit, after="", prefix="", user=None):
+        # a range scan of the primary key - or of the (user, filename) index when filtering by user
+        clauses = ["filename > ?"]
+        params = [after]
+        if prefix:
+            clauses.append("filename >= ? AND filename < ?")
+            params += [prefix, prefix_end(prefix)]
+        if user is not None:
+            clauses.append("user = ?")
+            params.append(user)
+        sql = f"{self.SELECT_FILES} WHERE {' AND '.join(clauses)} ORDER BY filename LIMIT ?"
+        with self._conn() as conn:
+            return [self._record(row) for row in conn.execute(sql, params + [limit])]
+
+    def get_usage(self, user):
+        with self._conn() as conn:
+            row = conn.execute(self.GET_USAGE, (user,)).fetchone()
+        files, size = row if row is not None else (0, 0)
+        return {"files": files, "bytes": size}
+
+    def add_user(self, username, password):
+        with self._conn() as conn, conn:
+            return conn.execute(self.ADD_USER, (username, password)).rowcount == 1
+
+    def get_user(self, username):
+        with self._conn() as conn:
+            row = conn.execute(self.GET_USER, (username,)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.pool_lock:
+                self.opened -= 1
+
+
+def open_store(kind, path, synchronous="FULL", log_dir=None, snapshot_every=100000, pool_size=8):
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "logged":
+        return LoggedStore(log_dir, snapshot_every=snapshot_every, sync=synchronous != "OFF")
+    if kind == "sqlite":
+        return SQLiteStore(path, synchronous=synchronous, pool_size=pool_size)
+    raise ValueError(f"Unknown metadata store '{kind}'")
@@ -2,14 +2,253 @@ import os
 import jwt
 import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, redirect
 import requests, os
+from requests.adapters import HTTPAdapter
+import hashlib
+import hmac
+import random
+import re
+import threading
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlencode
 
 app = Flask(__name__)
 
 METADATA_API = "http://metadata1:5005" # metadata service URL
-STORAGE_API = "http://storage1:5008" # storage service URL
+STORAGE_REPLICAS = os.environ.get("STORAGE_REPLICAS", "http://storage1:5008,http://storage2:5009").split(",") # every storage node - 2PC commits each file to all of them
+STORAGE_TIMEOUT = float(os.environ.get("STORAGE_TIMEOUT", "10")) # seconds to wait for a storage node to start answering
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", "0.95")) # a read slower than this quantile of recent reads gets a hedged request to another replica
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.01")) # never hedge sooner than this, however fast recent reads were
+HEDGE_SAMPLES = int(os.environ.get("HEDGE_SAMPLES", "1000")) # recent response times the hedge threshold is taken from
+REPLICA_COOLDOWN = float(os.environ.get("REPLICA_COOLDOWN", "5")) # seconds a replica that failed is only tried after the healthy ones
+STRIPE_SIZE = int(os.environ.get("STRIPE_SIZE", str(8 * 1024 * 1024))) # bytes per range request when a whole file is fetched in stripes
+STRIPE_CONCURRENCY = int(os.environ.get("STRIPE_CONCURRENCY", "4")) # stripes fetched ahead in parallel across the replicas - 1 streams from a single replica
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32")) # keep-alive connections kept open to each storage replica
+PROXY_CHUNK_SIZE = int(os.environ.get("PROXY_CHUNK_SIZE", str(1024 * 1024))) # bytes read from storage per chunk of a proxied download
+DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", "") # "" proxies the bytes, "redirect" sends the client to storage, "accel" hands the body to a fronting proxy via X-Accel-Redirect
+STORAGE_PUBLIC_URLS = os.environ.get("STORAGE_PUBLIC_URLS", ",".join(STORAGE_REPLICAS)).split(",") # replica URLs as clients reach them, same order as STORAGE_REPLICAS
+ACCEL_REDIRECT_PREFIX = os.environ.get("ACCEL_REDIRECT_PREFIX", "/internal/storage") # internal location of the fronting proxy - replica i is served under <prefix>/<i>/
+DOWNLOAD_SIGNING_KEY = os.environ.get("DOWNLOAD_SIGNING_KEY", "") # when set, storage URLs carry an expiring HMAC signature - must match the storage nodes
+DOWNLOAD_URL_TTL = int(os.environ.get("DOWNLOAD_URL_TTL", "300")) # seconds a signed storage URL stays valid
+LATENCY_DECAY = 0.2 # weight of the newest response time in a replica's moving average
+
+# a mistyped mode would otherwise fall through to X-Accel-Redirect and, without a proxy in front, send empty bodies
+if DOWNLOAD_OFFLOAD not in ("", "redirect", "accel"):
+    raise ValueError(f"Unknown DOWNLOAD_OFFLOAD '{DOWNLOAD_OFFLOAD}' - expected '', 'redirect' or 'accel'")
+if len(STORAGE_PUBLIC_URLS) != len(STORAGE_REPLICAS):
+    raise ValueError("STORAGE_PUBLIC_URLS needs one URL for each of STORAGE_REPLICAS")
+
+# one keep-alive session for every call to storage, instead of a new connection per request
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=len(STORAGE_REPLICAS), pool_maxsize=HTTP_POOL_SIZE))
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey") # secret key for JWT - in more secure setup, use env variable
+FORWARDED_HEADERS = ("Range", "If-Range") # client headers passed on to storage so partial downloads work end to end
+RELAYED_HEADERS = ("Content-Length", "Content-Range", "Accept-Ranges", "ETag", "Last-Modified") # storage headers passed back to the client
+
+
+# --- Replica routing ---
+# reads go to the replica with the fewest requests in flight (then the lowest average response time),
+# a read slower than the recent p95 is hedged to the next replica, and errors fail over to the rest
+class ReplicaRouter:
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self.lock = threading.Lock()
+        self.outstanding = {replica: 0 for replica in replicas}
+        self.latency = {replica: 0.0 for replica in replicas}
+        self.failed_until = {replica: 0.0 for replica in replicas}
+        self.samples = deque(maxlen=HEDGE_SAMPLES)
+
+    # replicas in the order they should be tried - shuffled first so ties spread the load
+    def ranked(self):
+        now = time.monotonic()
+        order = list(self.replicas)
+        random.shuffle(order)
+        with self.lock:
+            return sorted(order, key=lambda r: (self.failed_until[r] > now, self.outstanding[r], self.latency[r]))
+
+    def begin(self, replica):
+        with self.lock:
+            self.outstanding[replica] += 1
+
+    def finish(self, replica):
+        with self.lock:
+            self.outstanding[replica] -= 1
+
+    # elapsed is None when the replica failed
+    def observe(self, replica, elapsed):
+        with self.lock:
+            if elapsed is None:
+                self.failed_until[replica] = time.monotonic() + REPLICA_COOLDOWN
+                return
+            self.failed_until[replica] = 0.0
+            self.latency[replica] += LATENCY_DECAY * (elapsed - self.latency[replica])
+            self.samples.append(elapsed)
+
+    # how long to wait on a replica before hedging - None until there are enough samples to trust
+    def hedge_delay(self):
+        with self.lock:
+            if len(self.samples) < 20:
+                return None
+            samples = sorted(self.samples)
+        return max(HEDGE_MIN_DELAY, samples[int(len(samples) * HEDGE_QUANTILE)])
+
+
+router = ReplicaRouter(STORAGE_REPLICAS)
+hedge_pool = ThreadPoolExecutor(max_workers=32)
+
+
+# one GET against one replica - the time until its headers arrive feeds the router
+def get_from(replica, path, params, headers):
+    started = time.monotonic()
+    try:
+        resp = http.get(f"{replica}{path}", params=params, headers=headers, stream=True, timeout=STORAGE_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"Read from {replica} failed: {e}")
+        router.observe(replica, None)
+        raise
+    router.observe(replica, time.monotonic() - started if resp.status_code < 500 else None)
+    return resp
+
+
+# a hedged request that lost the race - drop its connection once it answers
+def discard(replica, future):
+    try:
+        future.result().close()
+    except Exception:
+        pass
+    router.finish(replica)
+
+
+# GET from the best replica, hedging and failing over - returns (replica, response) for the first
+# usable answer, or (None, response) when there is none: a 404 only if every replica answered 404,
+# otherwise the last error response, or None when no replica answered at all.
+# a replica that missed a commit, or is still applying it, says 404 while the others have the file
+def routed_get(path, params, headers):
+    candidates = router.ranked()
+    pending = {}
+    hedged = False
+    last = None
+    missing = None
+    failed = False
+
+    def launch():
+        replica = candidates.pop(0)
+        router.begin(replica)
+        pending[hedge_pool.submit(get_from, replica, path, params, headers)] = replica
+
+    launch()
+    while pending:
+        delay = router.hedge_delay() if candidates and not hedged else None
+        done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+        if not done:
+            # slower than recent p95 - ask another replica too and take whichever answers first
+            hedged = True
+            launch()
+            continue
+        for future in done:
+            replica = pending.pop(future)
+            try:
+                resp = future.result()
+            except requests.exceptions.RequestException:
+                resp = None
+            if resp is not None and resp.status_code < 500 and resp.status_code != 404:
+                for other, other_replica in pending.items():
+                    other.add_done_callback(lambda f, r=other_replica: discard(r, f))
+                if missing is not None:
+                    missing.close()
+                return replica, resp
+            router.finish(replica)
+            if resp is not None and resp.status_code == 404:
+                if missing is not None:
+                    missing.close()
+                missing = resp
+            else:
+                failed = True
+                if resp is not None:
+                    if last is not None:
+                        last.close()
+                    last = resp
+            if candidates and not pending:
+                launch()
+    if not failed:
+        return None, missing
+    if missing is not None:
+        missing.close()
+    return None, last
+
+
+# keeps the replica counted as busy until the body has been streamed out
+def relay(replica, resp):
+    try:
+        for chunk in resp.iter_content(chunk_size=PROXY_CHUNK_SIZE):
+            yield chunk
+    finally:
+        resp.close()
+        router.finish(replica)
+
+
+# query parameters for a storage /download URL - signed when DOWNLOAD_SIGNING_KEY is set
+def download_params(filename):
+    params = {"filename": filename}
+    if DOWNLOAD_SIGNING_KEY:
+        params["expires"] = str(int(time.time()) + DOWNLOAD_URL_TTL)
+        message = f"{filename}:{params['expires']}".encode()
+        params["signature"] = hmac.new(DOWNLOAD_SIGNING_KEY.encode(), message, hashlib.sha256).hexdigest()
+    return params
+
+
+# --- Striped downloads ---
+stripe_pool = ThreadPoolExecutor(max_workers=32)
+
+
+# one byte range of the file, read whole - If-Range makes a replica holding another version answer 200
+def fetch_stripe(filename, start, end, etag):
+    headers = {"Range": f"bytes={start}-{end}"}
+    if etag:
+        headers["If-Range"] = etag
+    replica, resp = routed_get("/download", download_params(filename), headers)
+    if resp is None:
+        raise IOError(f"No storage replica available for bytes {start}-{end}")
+    try:
+        if resp.status_code != 206:
+            raise IOError(f"Stripe {start}-{end} failed with status {resp.status_code}")
+        return resp.content
+    finally:
+        resp.close()
+        if replica is not None:
+            router.finish(replica)
+
+
+# stripes only fit together when the ETag is the file's checksum - without a .sha256 file storage tags
+# the bytes by mtime, which differs between replicas, so If-Range on any other replica would fail
+CHECKSUM_ETAG = re.compile(r'"[0-9a-f]{64}"')
+
+
+def can_stripe(first):
+    total = int(first.headers["Content-Range"].rsplit("/", 1)[1])
+    return total <= STRIPE_SIZE or CHECKSUM_ETAG.fullmatch(first.headers.get("ETag", "")) is not None
+
+
+# the first stripe is relayed as it streams in while the next STRIPE_CONCURRENCY stripes are fetched
+# in parallel - routed_get spreads them over the replicas - and each is sent on in file order.
+# a failed stripe cuts the response short, so the client sees fewer bytes than Content-Length
+def stripes(replica, first, filename, total, etag):
+    ranges = ((start, min(start + STRIPE_SIZE, total) - 1) for start in range(STRIPE_SIZE, total, STRIPE_SIZE))
+    window = deque(stripe_pool.submit(fetch_stripe, filename, start, end, etag) for start, end in islice(ranges, STRIPE_CONCURRENCY))
+    try:
+        yield from relay(replica, first)
+        while window:
+            data = window.popleft().result()
+            for start, end in islice(ranges, 1):
+                window.append(stripe_pool.submit(fetch_stripe, filename, start, end, etag))
+            yield data
+    finally:
+        for future in window:
+            future.cancel()
 
 
 # --- JWT Helpers ---
@@ -50,17 +289,54 @@ def download():
     if not filename:
         return jsonify({"error": "No filename provided"}), 400
 
-    # forward request to storage service via GET
-    params = {"filename": filename}
-    resp = requests.get(f"{STORAGE_API}/download", params=params, stream=True)
+    # storage sends the bytes itself - the gateway only checks the token and picks the replica
+    if DOWNLOAD_OFFLOAD:
+        index = STORAGE_REPLICAS.index(router.ranked()[0])
+        query = urlencode(download_params(filename))
+        if DOWNLOAD_OFFLOAD == "redirect":
+            return redirect(f"{STORAGE_PUBLIC_URLS[index]}/download?{query}", code=307)
+        return Response(headers={
+            "X-Accel-Redirect": f"{ACCEL_REDIRECT_PREFIX}/{index}/download?{query}",
+            "Content-Disposition": f"attachment; filename={filename}"
+        })
+
+    # forward request to a storage replica via GET
+    params = download_params(filename)
+    headers = {key: request.headers[key] for key in FORWARDED_HEADERS if key in request.headers}
+    striped = not headers and STRIPE_CONCURRENCY > 1
+    if striped:
+        # a whole-file download starts with the first stripe - its Content-Range gives the file size
+        replica, resp = routed_get("/download", params, {"Range": f"bytes=0-{STRIPE_SIZE - 1}"})
+        if resp is not None and (resp.status_code == 416 or resp.status_code == 206 and not can_stripe(resp)):
+            # an empty file has no first stripe, and a file without a checksum comes whole from one replica
+            resp.close()
+            router.finish(replica)
+            striped = False
+    if not striped:
+        replica, resp = routed_get("/download", params, headers)
+    if resp is None:
+        return jsonify({"error": "No storage replica available"}), 503
 
-    # check response from storage service
-    if resp.status_code == 200:
+    # check response from storage service - 206 is a requested byte range, 416 a range past the end
+    relayed = {key: resp.headers[key] for key in RELAYED_HEADERS if key in resp.headers}
+    if resp.status_code in (200, 206):
+        relayed["Content-Disposition"] = f"attachment; filename={filename}"
+        body, status = relay(replica, resp), resp.status_code
+        if striped and resp.status_code == 206:
+            total = int(resp.headers["Content-Range"].rsplit("/", 1)[1])
+            del relayed["Content-Range"]
+            relayed["Content-Length"] = str(total)
+            body, status = stripes(replica, resp, filename, total, resp.headers.get("ETag")), 200
         return Response(
-            resp.iter_content(chunk_size=8192),
+            body,
+            status=status,
             content_type=resp.headers.get('Content-Type'),
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
+            headers=relayed
         )
+    if replica is not None:
+        router.finish(replica)
+    if resp.status_code == 416:
+        return Response(status=416, headers=relayed)
     else:
         try:
             return jsonify(resp.json()), resp.status_code
@@ -76,14 +352,29 @@ def delete_file():
     if not filename:
         return jsonify({"error": "No filename provided"}), 400
     
-    # forward request to storage service via DELETE
+    # forward request to every storage replica via DELETE - a copy left behind would be served again
     params = {"filename": filename}
-    resp = requests.delete(f"{STORAGE_API}/delete", params=params)
-    # check response from metadata service
-    if resp.status_code == 200:
-        return resp.json(), resp.status_code
+
+    def delete_from(replica):
+        try:
+            return http.delete(f"{replica}/delete", params=params, timeout=STORAGE_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            return e
+
+    results = dict(zip(STORAGE_REPLICAS, hedge_pool.map(delete_from, STORAGE_REPLICAS)))
+    # check responses from the storage replicas - one that never had the file is fine
+    deleted = [r for r in results.values() if not isinstance(r, Exception) and r.status_code == 200]
+    failed = {
+        replica: str(r) if isinstance(r, Exception) else r.text
+        for replica, r in results.items()
+        if isinstance(r, Exception) or r.status_code not in (200, 404)
+    }
+    if deleted and not failed:
+        return deleted[0].json(), 200
+    elif not deleted and not failed:
+        return jsonify({"error": "File not found"}), 404
     else:
-        return jsonify({"error": "Delete error - " + resp.text}), 500
+        return jsonify({"error": "Delete error - " + "; ".join(f"{r}: {e}" for r, e in failed.items())}), 500
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5004)
\ No newline at end of file
@@ -1,88 +1,685 @@
 import os
 import jwt
 import datetime
-import uuid, grpc, sys
+import uuid, grpc, sys, time, queue, threading, hashlib, collections, itertools
+from concurrent import futures
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Data, Epilogue
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import LimitedStream
 from flask import Flask, request, jsonify, Response
 import requests
+from requests.adapters import HTTPAdapter
 
 sys.path.insert(0, '/app/proto')
 import twopc_pb2
 import twopc_pb2_grpc
 
+from decision_log import DecisionLog, read_records
+
 app = Flask(__name__)
 
 METADATA_API = "http://metadata1:5005" # metadata service URL
 STORAGE_API = "http://storage1:5006" # storage service URL
 SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey") # secret key for JWT - in more secure setup, use env variable
+VOTE_TIMEOUT = float(os.environ.get("VOTE_TIMEOUT", "10")) # overall deadline (seconds) for collecting every vote
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024))) # bytes per VoteRequestStream chunk
+UPLOAD_MIN_RATE = float(os.environ.get("UPLOAD_MIN_RATE", str(5 * 1024 * 1024))) # bytes/sec assumed when extending the vote deadline for large files
+FANOUT_QUEUE_DEPTH = int(os.environ.get("FANOUT_QUEUE_DEPTH", "4")) # chunks buffered per storage participant while streaming an upload
+
+PREPARE_MODE = os.environ.get("PREPARE_MODE", "parallel") # "parallel" or "reserve_first"
+DECISION_TIMEOUT = float(os.environ.get("DECISION_TIMEOUT", "10")) # per-attempt deadline (seconds) for GlobalDecision
+DECISION_ACK_MODE = os.environ.get("DECISION_ACK_MODE", "sync") # "sync" waits for every ack, "async" answers the client once the decision is made
+DECISION_RETRIES = int(os.environ.get("DECISION_RETRIES", "5")) # delivery attempts per participant before giving up
+DECISION_RETRY_BACKOFF = float(os.environ.get("DECISION_RETRY_BACKOFF", "0.5")) # seconds before the first retry, doubled each time
+DECISION_WORKERS = int(os.environ.get("DECISION_WORKERS", "8")) # background threads delivering decisions in async mode
+DECISION_TRANSPORT = os.environ.get("DECISION_TRANSPORT", "unary") # "unary" RPC per decision, or "stream" over one long-lived DecisionStream per participant
+DECISION_STREAM_MAX_BATCH = int(os.environ.get("DECISION_STREAM_MAX_BATCH", "256")) # decisions coalesced into one DecisionStream message
+DECISION_LOG_PATH = os.environ.get("DECISION_LOG_PATH", "/coordinator/decisions.log") # append-only coordinator decision log
+DECISION_LOG_GROUP_COMMIT = os.environ.get("DECISION_LOG_GROUP_COMMIT", "1") == "1" # share one fsync between concurrent decisions
+DECISION_LOG_BATCH_MS = float(os.environ.get("DECISION_LOG_BATCH_MS", "0")) # how long a group commit waits for more decisions to join
+DECISION_LOG_CHECKPOINT_EVERY = int(os.environ.get("DECISION_LOG_CHECKPOINT_EVERY", "10000")) # records appended before the log is rewritten with only unfinished transactions
+COMMIT_PROTOCOL = os.environ.get("COMMIT_PROTOCOL", "presumed_nothing") # "presumed_nothing" or "presumed_abort" - must match the participants
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "1000")) # files accepted by one /files/upload/batch request
+BATCH_MAX_BYTES = int(os.environ.get("BATCH_MAX_BYTES", str(32 * 1024 * 1024))) # total request size accepted by /files/upload/batch
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("GROUP_COMMIT_WINDOW_MS", "0")) # how long small uploads wait to share a 2PC round, 0 disables group commit
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", "64")) # uploads per shared round - a full group starts without waiting out the window
+GROUP_COMMIT_MAX_BYTES = int(os.environ.get("GROUP_COMMIT_MAX_BYTES", str(256 * 1024))) # uploads up to this size are eligible for group commit
+GROUP_COMMIT_WORKERS = int(os.environ.get("GROUP_COMMIT_WORKERS", "4")) # shared rounds allowed in flight at once
+GRPC_MAX_MESSAGE = int(os.environ.get("GRPC_MAX_MESSAGE", str(64 * 1024 * 1024))) # largest gRPC message sent - a batch carries its files inline
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "32")) # keep-alive connections kept open to the metadata service
+
+# one keep-alive session for every call to the metadata service, instead of a new connection per request
+http = requests.Session()
+http.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+
+# participant roles - storage nodes receive the file bytes, metadata nodes only the FileMetadata
+STORAGE_ROLE = "storage"
+METADATA_ROLE = "metadata"
+
+class UploadStream:
+    # pulls the "file" part out of a multipart body as it arrives instead of buffering the request
+    def __init__(self, stream, boundary):
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary.encode())
+        self.events = self._events()
+
+    def _events(self):
+        while True:
+            event = self.decoder.next_event()
+            if isinstance(event, NeedData):
+                data = self.stream.read(UPLOAD_CHUNK_SIZE)
+                self.decoder.receive_data(data if data else None)
+            elif isinstance(event, Epilogue):
+                return
+            else:
+                yield event
+
+    def open(self):
+        # skip ahead to the "file" part and return its filename, or None if there is no file part
+        for event in self.events:
+            if isinstance(event, File) and event.name == "file":
+                return event.filename
+        return None
+
+    def chunks(self):
+        for event in self.events:
+            if isinstance(event, Data):
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+
+class StreamFanout:
+    # tees one chunk source into a bounded queue per storage participant, hashing and counting on the way
+    def __init__(self, source):
+        self.source = source
+        self.queues = {}
+        self.detached = set()
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.error = None
+        self.on_finished = None
+        self.thread = threading.Thread(target=self._pump, daemon=True)
+
+    def subscribe(self, participant_id, header):
+        q = queue.Queue(maxsize=FANOUT_QUEUE_DEPTH)
+        self.queues[participant_id] = q
+        return self._consume(participant_id, q, header)
+
+    def detach(self, participant_id):
+        # a finished or cancelled prepare no longer drains its queue
+        self.detached.add(participant_id)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.detached.update(self.queues)
+        if self.thread.ident is not None:
+            self.thread.join()
+
+    def _pump(self):
+        completed = False
+        try:
+            for chunk in self.source:
+                if self.detached.issuperset(self.queues):
+                    # every prepare is already over - stop reading the upload
+                    self.error = Exception("Upload abandoned")
+                    break
+
+                self.size += len(chunk)
+                self.sha256.update(chunk)
+                for participant_id, q in self.queues.items():
+                    self._put(participant_id, q, chunk)
+            else:
+                completed = True
+        except Exception as e:
+            print(f"[Coordinator] Upload stream failed: {e}")
+            self.error = e
+
+        for participant_id, q in self.queues.items():
+            self._put(participant_id, q, None)
+
+        if completed and self.on_finished is not None:
+            self.on_finished()
+
+    def _put(self, participant_id, q, item):
+        while participant_id not in self.detached:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _consume(self, participant_id, q, header):
+        # header first, then the file in chunks so no single message carries the whole file
+        yield twopc_pb2.VoteRequestChunk(header=header)
+
+        while True:
+            try:
+                chunk = q.get(timeout=0.1)
+            except queue.Empty:
+                if participant_id in self.detached:
+                    return
+                continue
+            if chunk is None:
+                break
+            yield twopc_pb2.VoteRequestChunk(chunk=chunk)
+
+        if self.error is not None:
+            # abandon the stream so the participant never prepares a truncated file
+            raise self.error
+
+class VoteCollector:
+    # gathers votes as they arrive and stops at the first abort, RPC failure or the deadline
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.started = time.monotonic()
+        self.calls = {}
+        self.votes = {}
+        self.responses = {}
+        self.timings = {}
+        self.finished = queue.Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def submit(self, participant_id, call):
+        with self.lock:
+            self.calls[participant_id] = call
+            if self.closed:
+                call.cancel()
+                return
+        call.add_done_callback(lambda f, pid=participant_id: self._on_done(pid, f))
+
+    def _on_done(self, participant_id, call):
+        self.timings.setdefault(participant_id, time.monotonic() - self.started)
+        self.finished.put((participant_id, call))
+
+    def cancel_outstanding(self):
+        # stop every prepare whose outcome no longer matters
+        with self.lock:
+            self.closed = True
+            for participant_id, call in self.calls.items():
+                if call.cancel():
+                    print(f" Cancelled VoteRequest to Node {participant_id}")
+
+    def collect(self, expected=None):
+        # expected covers participants whose VoteRequest is only submitted later on
+        pending = set(expected if expected is not None else self.calls)
+
+        while pending:
+            try:
+                participant_id, call = self.finished.get(timeout=max(0, self.deadline - time.monotonic()))
+            except queue.Empty:
+                for participant_id in pending:
+                    print(f" Node {participant_id} did not vote before the deadline")
+                    self.votes[participant_id] = twopc_pb2.VOTE_ABORT
+                break
+
+            if participant_id not in pending:
+                continue
+            pending.discard(participant_id)
+
+            try:
+                response = call.result()
+                vote_str = twopc_pb2.VoteDecision.Name(response.vote)
+                print(f" Node {participant_id} voted: {vote_str}")
+
+                if response.vote == twopc_pb2.VOTE_ABORT:
+                    print(f"Reason: {response.reason}")
+
+                self.votes[participant_id] = response.vote
+                self.responses[participant_id] = response
+            except grpc.RpcError as e:
+                print(f" Failed to get vote from Node {participant_id}: {e}")
+                self.votes[participant_id] = twopc_pb2.VOTE_ABORT
+
+            # one abort decides the transaction - no point waiting for the rest
+            if self.votes[participant_id] == twopc_pb2.VOTE_ABORT:
+                for other_id in pending:
+                    self.votes[other_id] = twopc_pb2.VOTE_ABORT
+                break
+
+        self.cancel_outstanding()
+        return self.votes
+
+    def report(self):
+        for participant_id in self.calls:
+            elapsed = self.timings.get(participant_id)
+            timing_str = f"{elapsed * 1000:.1f} ms" if elapsed is not None else "no response"
+            print(f" [Coordinator] Node {participant_id} vote latency: {timing_str}")
+        print(f" [Coordinator] Voting phase took {(time.monotonic() - self.started) * 1000:.1f} ms")
+
+class DecisionStreamError(grpc.RpcError):
+    # a decision sent over a DecisionStream that failed or was never acknowledged in time
+    pass
+
+class DecisionStream:
+    # one long-lived DecisionStream call to a participant - decisions queued by concurrent transactions
+    # go out together in one message and come back as one BatchDecisionAck with the acks in order
+    def __init__(self, participant_id, stub):
+        self.participant_id = participant_id
+        self.stub = stub
+        self.lock = threading.Lock()
+        self.outgoing = queue.Queue()
+        self.in_flight = collections.deque()
+        self.generation = 0
+        self.open = False
+
+    def send(self, batch_id, decisions):
+        # decisions is a list of (txn_id, decision) - returns a future of the BatchDecisionAck for exactly these
+        handle = {
+            "future": futures.Future(),
+            "batch_id": batch_id,
+            "decisions": decisions,
+            "acks": [None] * len(decisions),
+            "remaining": len(decisions),
+            "deadline": time.monotonic() + DECISION_TIMEOUT
+        }
+        with self.lock:
+            if not self.open:
+                # (re)connect lazily - a broken stream is replaced by the next decision that needs it
+                self.open = True
+                self.generation += 1
+                responses = self.stub.DecisionStream(self._requests(self.generation))
+                threading.Thread(target=self._receive, args=(self.generation, responses), daemon=True).start()
+            self.outgoing.put(handle)
+        return handle["future"]
+
+    def _requests(self, generation):
+        while True:
+            with self.lock:
+                if generation != self.generation or not self.open:
+                    return
+            self._expire()
+
+            try:
+                batch = [self.outgoing.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+            count = len(batch[0]["decisions"])
+            while count < DECISION_STREAM_MAX_BATCH:
+                try:
+                    handle = self.outgoing.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(handle)
+                count += len(handle["decisions"])
+
+            slots = []
+            message = twopc_pb2.BatchDecisionMsg(batch_id=batch[0]["batch_id"])
+            for handle in batch:
+                for index, (txn_id, decision) in enumerate(handle["decisions"]):
+                    message.decisions.add(transaction_id=txn_id, decision=decision)
+                    slots.append((handle, index))
+            with self.lock:
+                if generation != self.generation:
+                    # this stream was replaced while we waited - leave the decisions to its successor
+                    for handle in batch:
+                        self.outgoing.put(handle)
+                    return
+                self.in_flight.append(slots)
+            yield message
+
+    def _receive(self, generation, responses):
+        try:
+            for response in responses:
+                with self.lock:
+                    slots = self.in_flight.popleft()
+                for (handle, index), ack in zip(slots, response.acks):
+                    handle["acks"][index] = ack
+                    handle["remaining"] -= 1
+                    if handle["remaining"] == 0 and not handle["future"].done():
+                        handle["future"].set_result(twopc_pb2.BatchDecisionAck(
+                            batch_id=handle["batch_id"],
+                            node_id=response.node_id,
+                            success=all(a.success for a in handle["acks"]),
+                            acks=handle["acks"]
+                        ))
+            error = DecisionStreamError("DecisionStream closed by participant")
+        except grpc.RpcError as e:
+            error = DecisionStreamError(f"DecisionStream failed: {e.code()}")
+
+        print(f"[Coordinator] DecisionStream to Node {self.participant_id} ended: {error}")
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.open = False
+            # nothing queued or in flight will be answered on this stream any more
+            pending = [handle for slots in self.in_flight for handle, _ in slots]
+            self.in_flight.clear()
+            while not self.outgoing.empty():
+                pending.append(self.outgoing.get_nowait())
+        for handle in pending:
+            if not handle["future"].done():
+                handle["future"].set_exception(error)
 
-class TwoPhaseCommitCoordinator:
+    def _expire(self):
+        # a decision without an ack by its deadline is reported as failed so the sender can retry it
+        now = time.monotonic()
+        with self.lock:
+            expired = [handle for slots in self.in_flight for handle, _ in slots if handle["deadline"] < now]
+        for handle in expired:
+            if not handle["future"].done():
+                handle["future"].set_exception(DecisionStreamError("DecisionStream ack deadline exceeded"))
+
+class GroupCommitter:
+    # coalesces small independent uploads that arrive close together into one multi-transaction 2PC round
+    def __init__(self, coordinator, window, max_batch, workers):
+        self.coordinator = coordinator
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = queue.Queue()
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, filename, data, user, declared_size=None, declared_checksum=None):
+        # blocks until the shared round has decided this upload - returns (success, sha256 hex)
+        entry = {
+            "filename": filename,
+            "data": data,
+            "user": user,
+            "declared_size": declared_size,
+            "declared_checksum": declared_checksum,
+            "success": False,
+            "checksum": None,
+            "done": threading.Event()
+        }
+        self.pending.put(entry)
+        entry["done"].wait()
+        return entry["success"], entry["checksum"]
+
+    def _run(self):
+        while True:
+            # the window opens with the first upload of a group
+            group = [self.pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(group) < self.max_batch:
+                try:
+                    group.append(self.pending.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self.executor.submit(self._execute, group)
+
+    def _execute(self, group):
+        try:
+            self.coordinator.execute_group(group)
+        except Exception as e:
+            print(f"[Coordinator] Group commit failed: {e}")
+        for entry in group:
+            entry["done"].set()
+
+class TwoPhaseCommitCoordinator(twopc_pb2_grpc.TwoPhaseCommitServicer):
     def __init__(self):
         self.node_id = "1"
         print(f"[Cordinator Node {self.node_id}] Initializing 2PC Coordinator...")
 
         self.participants = {
-            "2": ("storage1", 50052),
-            "3": ("storage2", 50053),
-            "4": ("metadata1", 50054),
-            "5": ("metadata2", 50055)
+            "2": ("storage1", 50052, STORAGE_ROLE),
+            "3": ("storage2", 50053, STORAGE_ROLE),
+            "4": ("metadata1", 50054, METADATA_ROLE),
+            "5": ("metadata2", 50055, METADATA_ROLE)
         }
 
         self.channels = {}
         self.stubs = {}
+        self.decision_streams = {}
+        self.roles = {}
+        self.decision_executor = futures.ThreadPoolExecutor(max_workers=DECISION_WORKERS)
+
+        # what QueryDecision answers from: transactions still voting, and commits not yet acknowledged by everyone
+        self.state_lock = threading.Lock()
+        self.active = set()
+        self.committed = set()
 
-        for node_id, (host, port) in self.participants.items():
+        for node_id, (host, port, role) in self.participants.items():
+            self.roles[node_id] = role
             try:
-                channel = grpc.insecure_channel(f"{host}:{port}")
+                channel = grpc.insecure_channel(f"{host}:{port}", options=[
+                    ('grpc.max_send_message_length', GRPC_MAX_MESSAGE),
+                    ('grpc.max_receive_message_length', GRPC_MAX_MESSAGE)
+                ])
                 self.channels[node_id] = channel
                 self.stubs[node_id] = twopc_pb2_grpc.TwoPhaseCommitStub(channel)
+                self.decision_streams[node_id] = DecisionStream(node_id, twopc_pb2_grpc.DecisionChannelStub(channel))
                 print(f"[Coordinator] Connected to Node {node_id} at {host}:{port}")
             except Exception as e:
                 print(f"[Coordinator] Failed to connect to Node {node_id}: {e}")
 
-    def voting_phase(self, txn_id, filename, file_data, user):
-        print("*" * 60)
-        print(f"[Coordinator] Starting VOTING PHASE for transaction {txn_id}")
-        print(f"[Coordinator] Operation: upload, File: {filename}, Size: {len(file_data)} bytes")
+        self.log = DecisionLog(
+            DECISION_LOG_PATH,
+            group_commit=DECISION_LOG_GROUP_COMMIT,
+            batch_window=DECISION_LOG_BATCH_MS / 1000,
+            checkpoint_every=DECISION_LOG_CHECKPOINT_EVERY
+        )
+        self.recover()
+
+    def recover(self):
+        # re-drive every transaction the log shows as unfinished after a crash - the log was just
+        # checkpointed, so it holds nothing else
+        transactions = {}
+        for record in read_records(DECISION_LOG_PATH):
+            transactions.setdefault(record["txn"], {})[record["type"]] = record
+
+        for txn_id, txn in transactions.items():
+            if "end" in txn:
+                continue
+
+            if "decision" in txn:
+                decision = twopc_pb2.GLOBAL_COMMIT if txn["decision"]["decision"] == "commit" else twopc_pb2.GLOBAL_ABORT
+                participant_ids = txn["decision"]["participants"]
+                members = txn["decision"].get("members")
+                if decision == twopc_pb2.GLOBAL_COMMIT:
+                    self.remember_commit(txn_id, members)
+            elif COMMIT_PROTOCOL == "presumed_abort":
+                # left over from a presumed-nothing run - participants asking about it will presume abort,
+                # so it is closed for the next checkpoint to drop
+                self.log.append({"type": "end", "txn": txn_id})
+                continue
+            else:
+                # crashed before deciding - nobody can have committed, so abort
+                decision = twopc_pb2.GLOBAL_ABORT
+                participant_ids = txn["start"]["participants"]
+                members = None
+                if "members" in txn["start"]:
+                    # a batch - every file in it may have been prepared anywhere
+                    members = {pid: txn["start"]["members"] for pid in participant_ids}
+                record = {"type": "decision", "txn": txn_id, "decision": "abort", "participants": participant_ids}
+                if members is not None:
+                    record["members"] = members
+                self.log.append(record, force=True)
+
+            print(f"[Coordinator] Recovering transaction {txn_id}: re-sending {'GLOBAL_COMMIT' if decision == twopc_pb2.GLOBAL_COMMIT else 'GLOBAL_ABORT'}")
+            self.decision_executor.submit(self.deliver_decision, txn_id, decision, participant_ids, members)
+
+    def member_ids(self, txn_id, members=None):
+        # participants prepare the files of a batch under their own transaction ids
+        if members is None:
+            return [txn_id]
+        return {member for txn_ids in members.values() for member in txn_ids}
+
+    def track(self, txn_ids):
+        with self.state_lock:
+            self.active.update(txn_ids)
+
+    def untrack(self, txn_ids):
+        with self.state_lock:
+            self.active.difference_update(txn_ids)
+
+    def remember_commit(self, txn_id, members=None):
+        with self.state_lock:
+            self.committed.update(self.member_ids(txn_id, members))
+
+    def forget(self, txn_id, members=None):
+        # every participant has the decision, so nobody will ask about it again
+        with self.state_lock:
+            self.committed.difference_update(self.member_ids(txn_id, members))
+
+    def transaction_state(self, txn_id):
+        with self.state_lock:
+            if txn_id in self.committed:
+                return twopc_pb2.STATE_COMMITTED
+            if txn_id in self.active:
+                return twopc_pb2.STATE_UNKNOWN
+        # not running and no pending commit - it aborted, or committed and was acknowledged by everyone
+        return twopc_pb2.STATE_ABORTED
 
-        votes = {}
+    def QueryDecision(self, request, context):
+        txn_id = request.transaction_id
+        state = self.transaction_state(txn_id)
+        print(f"[Coordinator] Node {request.node_id} asks about {txn_id}: {twopc_pb2.TransactionState.Name(state)}")
+        return twopc_pb2.DecisionStatus(transaction_id=txn_id, state=state, node_id=self.node_id)
 
-        metadata = twopc_pb2.FileMetadata(
+    def vote_header(self, txn_id, filename, user, size, checksum=""):
+        return twopc_pb2.VoteRequestMsg(
+            transaction_id=txn_id,
+            operation="upload",
             filename=filename,
-            size=len(file_data),
-            user=user
+            metadata=twopc_pb2.FileMetadata(
+                filename=filename,
+                size=size,
+                user=user,
+                checksum=checksum
+            )
         )
 
-        for participant_id, stub in self.stubs.items():
-            try:
-                print(f"Phase Voting of Node {self.node_id} sends RPC VoteRequest to Phase Voting of Node {participant_id}")
-
-                request = twopc_pb2.VoteRequestMsg(
-                    transaction_id=txn_id,
-                    operation="upload",
-                    filename=filename,
-                    file_data=file_data,
-                    metadata=metadata
+    def voting_phase(self, txn_id, filename, fanout, user, declared_size=None, size_hint=0, declared_checksum=None):
+        print("*" * 60)
+        print(f"[Coordinator] Starting VOTING PHASE for transaction {txn_id}")
+        size_str = f"{declared_size} bytes" if declared_size is not None else "not declared"
+        print(f"[Coordinator] Operation: upload, File: {filename}, Size: {size_str}")
+
+        # not forced - if this record is lost the participants can only have prepared, never committed
+        # under presumed abort a transaction without a decision record is aborted, so nothing is written
+        if COMMIT_PROTOCOL != "presumed_abort":
+            self.log.append({"type": "start", "txn": txn_id, "participants": list(self.stubs)})
+
+        header = self.vote_header(txn_id, filename, user, declared_size or 0, declared_checksum or "")
+        timeout = VOTE_TIMEOUT + max(declared_size or 0, size_hint) / UPLOAD_MIN_RATE
+
+        reserve_first = PREPARE_MODE == "reserve_first"
+        if reserve_first and declared_size is None:
+            print("[Coordinator] Upload size not declared - cannot reserve before the transfer, preparing in parallel")
+            reserve_first = False
+
+        if reserve_first:
+            # claim the filename on the metadata nodes before any bytes are shipped
+            print(f"[Coordinator] Reserving {filename} on metadata participants")
+            collector = VoteCollector(time.monotonic() + VOTE_TIMEOUT)
+            self.send_metadata_votes(collector, header)
+            votes = collector.collect()
+            collector.report()
+
+            if any(v == twopc_pb2.VOTE_ABORT for v in votes.values()):
+                print("[Coordinator] Reservation rejected - skipping the file transfer")
+            else:
+                collector = VoteCollector(time.monotonic() + timeout)
+                self.send_storage_votes(collector, header, fanout, timeout)
+                fanout.start()
+                votes.update(collector.collect())
+                collector.report()
+        else:
+            # fan out every VoteRequest at once so the phase costs as much as the slowest participant
+            collector = VoteCollector(time.monotonic() + timeout)
+            self.send_storage_votes(collector, header, fanout, timeout)
+
+            if declared_size is not None:
+                self.send_metadata_votes(collector, header)
+            else:
+                # the size is only known once the whole body has streamed through
+                fanout.on_finished = lambda: self.send_metadata_votes(
+                    collector, self.vote_header(txn_id, filename, user, fanout.size, fanout.sha256.hexdigest())
                 )
 
-                response = stub.VoteRequest(request, timeout=10)
-                votes[participant_id] = response.vote
+            fanout.start()
+            votes = collector.collect(expected=self.stubs.keys())
+            collector.report()
 
-                vote_str = "VOTE_COMMIT" if response.vote == twopc_pb2.VOTE_COMMIT else "VOTE_ABORT"
-                print(f" Node {participant_id} voted: {vote_str}")
+        fanout.stop()
 
-                if response.vote == twopc_pb2.VOTE_ABORT:
-                    print(f"Reason: {response.reason}")
+        # every storage node must have stored exactly the bytes the coordinator streamed
+        checksum = fanout.sha256.hexdigest()
+        for participant_id, response in collector.responses.items():
+            if self.roles[participant_id] == STORAGE_ROLE and response.checksum and response.checksum != checksum:
+                print(f" Node {participant_id} checksum mismatch: {response.checksum} != {checksum}")
+                votes[participant_id] = twopc_pb2.VOTE_ABORT
 
-            except grpc.RpcError as e:
-                print(f" Failed to get cote from Node {participant_id}: {e}")
+        # metadata nodes may have voted read-only on the declared checksum, so it has to be the real one
+        if declared_checksum and not fanout.error and declared_checksum != checksum:
+            print(f" Declared checksum {declared_checksum} does not match the uploaded content {checksum}")
+            for participant_id in votes:
                 votes[participant_id] = twopc_pb2.VOTE_ABORT
 
         print(f"\n [Coordinator] Votes collected: {votes}")
         return votes
-    
-    def decision_phase(self, txn_id, votes):
-        all_commit = all(v == twopc_pb2.VOTE_COMMIT for v in votes.values())
+
+    def send_storage_votes(self, collector, header, fanout, timeout):
+        for participant_id, stub in self.stubs.items():
+            if self.roles[participant_id] != STORAGE_ROLE:
+                continue
+            print(f"Phase Voting of Node {self.node_id} sends RPC VoteRequestStream to Phase Voting of Node {participant_id}")
+            call = stub.VoteRequestStream.future(fanout.subscribe(participant_id, header), timeout=timeout)
+            call.add_done_callback(lambda f, pid=participant_id: fanout.detach(pid))
+            collector.submit(participant_id, call)
+
+    def send_metadata_votes(self, collector, header):
+        # metadata nodes only validate the FileMetadata, so they never receive the file bytes
+        for participant_id, stub in self.stubs.items():
+            if self.roles[participant_id] != METADATA_ROLE:
+                continue
+            print(f"Phase Voting of Node {self.node_id} sends RPC VoteRequest to Phase Voting of Node {participant_id}")
+            collector.submit(participant_id, stub.VoteRequest.future(header, timeout=VOTE_TIMEOUT))
+
+    def batch_voting_phase(self, batch_id, txn_ids, files, headers, checksums, atomic):
+        print("*" * 60)
+        print(f"[Coordinator] Starting VOTING PHASE for batch {batch_id}")
+        total = sum(len(data) for _, data in files)
+        print(f"[Coordinator] Operation: batch upload, Files: {len(files)}, Size: {total} bytes, Atomic: {atomic}")
+
+        # storage nodes get the file bytes inline, metadata nodes only the headers
+        storage_requests = []
+        for header, (_, data) in zip(headers, files):
+            vote_request = twopc_pb2.VoteRequestMsg()
+            vote_request.CopyFrom(header)
+            vote_request.file_data = data
+            storage_requests.append(vote_request)
+
+        timeout = VOTE_TIMEOUT + total / UPLOAD_MIN_RATE
+        collector = VoteCollector(time.monotonic() + timeout)
+        for participant_id, stub in self.stubs.items():
+            vote_requests = storage_requests if self.roles[participant_id] == STORAGE_ROLE else headers
+            message = twopc_pb2.BatchVoteRequestMsg(batch_id=batch_id, requests=vote_requests, atomic=atomic)
+            print(f"Phase Voting of Node {self.node_id} sends RPC BatchVoteRequest to Phase Voting of Node {participant_id}")
+            collector.submit(participant_id, stub.BatchVoteRequest.future(message, timeout=timeout))
+
+        votes = collector.collect()
+        collector.report()
+
+        # per-file votes for every participant that answered, None for those that did not
+        file_votes = {}
+        corrupt = set()
+        for participant_id in self.stubs:
+            response = collector.responses.get(participant_id)
+            if response is None:
+                file_votes[participant_id] = None
+                continue
+            file_votes[participant_id] = {v.transaction_id: v.vote for v in response.votes}
+
+            if self.roles[participant_id] != STORAGE_ROLE:
+                continue
+            for vote, checksum in zip(response.votes, checksums):
+                if vote.checksum and vote.checksum != checksum:
+                    print(f" Node {participant_id} checksum mismatch for {vote.transaction_id}: {vote.checksum} != {checksum}")
+                    votes[participant_id] = twopc_pb2.VOTE_ABORT
+                    corrupt.add(vote.transaction_id)
+
+        print(f"\n [Coordinator] Votes collected: {votes}")
+        return votes, file_votes, corrupt
+
+    def decision_phase(self, txn_id, votes, members=None):
+        all_commit = all(v != twopc_pb2.VOTE_ABORT for v in votes.values())
         decision = twopc_pb2.GLOBAL_COMMIT if all_commit else twopc_pb2.GLOBAL_ABORT
 
         decision_str = "GLOBAL_COMMIT" if all_commit else "GLOBAL_ABORT"
@@ -90,40 +687,331 @@ class TwoPhaseCommitCoordinator:
         print(f"[Coordinator] Starting DECISION PHASE for transaction {txn_id}")
         print(f"[Coordinator] Decision: {decision_str}")
 
-        for participant_id, stub in self.stubs.items():
-            try:
-                print(f"Phase Decision of Node {self.node_id} sends RPC GlobalDecision to Phase Decision of Node {participant_id}")
-
-                response = stub.GlobalDecision(
-                    twopc_pb2.DecisionMsg(
-                        transaction_id=txn_id,
-                        decision=decision
-                    ),
-                    timeout=10
-                )
+        # only participants that were asked to prepare take part in the decision, and read-only ones have nothing to decide
+        participant_ids = [pid for pid, v in votes.items() if v != twopc_pb2.VOTE_READ_ONLY]
+        read_only = [pid for pid in votes if pid not in participant_ids]
+        if read_only:
+            print(f"[Coordinator] Nodes {read_only} voted read-only - leaving them out of the decision phase")
+        if members is not None:
+            # a batch only decides the files each participant actually prepared
+            participant_ids = [pid for pid in participant_ids if members[pid]]
+            members = {pid: members[pid] for pid in participant_ids}
 
-                if response.success:
-                    print(f"Node {participant_id} acknowledged {decision_str}")
-                else:
-                    print(f"Node {participant_id} failed to process {decision_str}")
-            
-            except grpc.RpcError as e:
-                print(f"Failed to send decision to Node {participant_id}: {e}")
+        if not participant_ids:
+            # nothing changed anywhere, so there is no decision to log or deliver
+            if COMMIT_PROTOCOL != "presumed_abort":
+                self.log.append({"type": "end", "txn": txn_id})
+            print("*" * 60)
+            return all_commit
+
+        if not all_commit and COMMIT_PROTOCOL == "presumed_abort":
+            # no record means abort, so the abort is neither logged nor acknowledged
+            self.send_abort(txn_id, participant_ids, members)
+            print("*" * 60)
+            return False
+
+        # the decision is durable before any participant hears it, so a restart can finish the job
+        record = {
+            "type": "decision",
+            "txn": txn_id,
+            "decision": "commit" if all_commit else "abort",
+            "participants": participant_ids
+        }
+        if members is not None:
+            record["members"] = members
+        self.log.append(record, force=True)
+        # only a durable commit may be reported to a participant asking - until then it is still active (unknown)
+        if all_commit:
+            self.remember_commit(txn_id, members)
+
+        if DECISION_ACK_MODE == "async":
+            # the outcome is fixed now - acks are collected (and retried) off the request path
+            self.decision_executor.submit(self.deliver_decision, txn_id, decision, participant_ids, members)
+        else:
+            self.deliver_decision(txn_id, decision, participant_ids, members)
 
         print("*" * 60)
         return all_commit
-    
-    def execute_upload(self, filename, file_data, user):
+
+    def send_decision(self, participant_id, txn_id, decision, members=None):
+        # one GlobalDecision for a single upload, one BatchGlobalDecision for a participant's share of a batch
+        if members is None and DECISION_TRANSPORT != "stream":
+            print(f"Phase Decision of Node {self.node_id} sends RPC GlobalDecision to Phase Decision of Node {participant_id}")
+            message = twopc_pb2.DecisionMsg(transaction_id=txn_id, decision=decision)
+            return self.stubs[participant_id].GlobalDecision.future(message, timeout=DECISION_TIMEOUT)
+
+        txn_ids = [txn_id] if members is None else members[participant_id]
+        return self.send_decisions(participant_id, txn_id, [(member, decision) for member in txn_ids])
+
+    def send_decisions(self, participant_id, batch_id, decisions):
+        # decisions is a list of (txn_id, decision) - the result has the per-transaction acks either way
+        if DECISION_TRANSPORT == "stream":
+            print(f"Phase Decision of Node {self.node_id} queues {len(decisions)} decisions on the DecisionStream to Phase Decision of Node {participant_id}")
+            return self.decision_streams[participant_id].send(batch_id, decisions)
+
+        print(f"Phase Decision of Node {self.node_id} sends RPC BatchGlobalDecision ({len(decisions)} decisions) to Phase Decision of Node {participant_id}")
+        message = twopc_pb2.BatchDecisionMsg(
+            batch_id=batch_id,
+            decisions=[twopc_pb2.DecisionMsg(transaction_id=txn_id, decision=decision) for txn_id, decision in decisions]
+        )
+        return self.stubs[participant_id].BatchGlobalDecision.future(message, timeout=DECISION_TIMEOUT)
+
+    def deliver_decision(self, txn_id, decision, participant_ids, members=None):
+        decision_str = "GLOBAL_COMMIT" if decision == twopc_pb2.GLOBAL_COMMIT else "GLOBAL_ABORT"
+        started = time.monotonic()
+        pending = list(participant_ids)
+        backoff = DECISION_RETRY_BACKOFF
+
+        for attempt in range(1, DECISION_RETRIES + 1):
+            # send the decision to every remaining participant at once
+            calls = {}
+            for participant_id in pending:
+                calls[participant_id] = self.send_decision(participant_id, txn_id, decision, members)
+
+            pending = []
+            for participant_id, call in calls.items():
+                try:
+                    response = call.result()
+                    if response.success:
+                        print(f"Node {participant_id} acknowledged {decision_str}")
+                        continue
+                    print(f"Node {participant_id} failed to process {decision_str}")
+                except grpc.RpcError as e:
+                    print(f"Failed to send decision to Node {participant_id}: {e}")
+                pending.append(participant_id)
+
+            if not pending:
+                print(f"[Coordinator] {decision_str} for {txn_id} acknowledged by all participants in {(time.monotonic() - started) * 1000:.1f} ms")
+                self.log.append({"type": "end", "txn": txn_id})
+                self.forget(txn_id, members)
+                return True
+
+            if attempt < DECISION_RETRIES:
+                print(f"[Coordinator] Retrying {decision_str} for {txn_id} to Nodes {pending} in {backoff:.1f}s")
+                time.sleep(backoff)
+                backoff *= 2
+
+        print(f"[Coordinator] Giving up on {decision_str} for {txn_id} - Nodes {pending} never acknowledged")
+        return False
+
+    def send_abort(self, txn_id, participant_ids, members=None):
+        # fire and forget - the abort only releases resources early, a participant that misses it presumes abort
+        def report(call, participant_id):
+            if call.exception() is not None:
+                print(f"Failed to send GLOBAL_ABORT to Node {participant_id}: {call.exception()}")
+
+        for participant_id in participant_ids:
+            call = self.send_decision(participant_id, txn_id, twopc_pb2.GLOBAL_ABORT, members)
+            call.add_done_callback(lambda f, pid=participant_id: report(f, pid))
+
+    def execute_upload(self, filename, chunks, user, declared_size=None, size_hint=0, declared_checksum=None):
         txn_id = str(uuid.uuid4())[:8]
         print(f"[Coordinator] New upload request: {filename} (Transaction ID: {txn_id})")
 
-        votes = self.voting_phase(txn_id, filename, file_data, user)
+        fanout = StreamFanout(chunks)
+        self.track([txn_id])
+        try:
+            votes = self.voting_phase(txn_id, filename, fanout, user, declared_size, size_hint, declared_checksum)
+            success = self.decision_phase(txn_id, votes)
+        finally:
+            self.untrack([txn_id])
 
-        success = self.decision_phase(txn_id, votes)
+        return success, fanout.size, fanout.sha256.hexdigest()
+
+    def execute_batch_upload(self, files, user, atomic=True):
+        # files is a list of (filename, data) - every file gets its own transaction id inside the batch
+        batch_id = str(uuid.uuid4())[:8]
+        print(f"[Coordinator] New batch upload request: {len(files)} files (Batch ID: {batch_id})")
+
+        txn_ids = [f"{batch_id}-{i}" for i in range(len(files))]
+        checksums = [hashlib.sha256(data).hexdigest() for _, data in files]
+        headers = [
+            self.vote_header(txn_id, filename, user, len(data), checksum)
+            for txn_id, (filename, data), checksum in zip(txn_ids, files, checksums)
+        ]
+
+        self.track(txn_ids)
+        try:
+            if COMMIT_PROTOCOL != "presumed_abort":
+                self.log.append({"type": "start", "txn": batch_id, "participants": list(self.stubs), "members": txn_ids})
+
+            votes, file_votes, _ = self.batch_voting_phase(batch_id, txn_ids, files, headers, checksums, atomic)
+
+            # each participant decides only the files it prepared - without an answer that could be any of them
+            members = {
+                participant_id: list(txn_ids) if votes_by_txn is None
+                else [txn_id for txn_id, vote in votes_by_txn.items() if vote == twopc_pb2.VOTE_COMMIT]
+                for participant_id, votes_by_txn in file_votes.items()
+            }
+            success = self.decision_phase(batch_id, votes, members)
+        finally:
+            self.untrack(txn_ids)
+
+        return success, batch_id, checksums
+
+    def execute_group(self, entries):
+        # independent uploads sharing one round - each keeps its own transaction id and its own outcome
+        group_id = str(uuid.uuid4())[:8]
+        print(f"[Coordinator] New group commit: {len(entries)} uploads (Group ID: {group_id})")
+
+        for i, entry in enumerate(entries):
+            entry["txn_id"] = f"{group_id}-{i}"
+            entry["checksum"] = hashlib.sha256(entry["data"]).hexdigest()
+
+        # an upload that does not match what the client declared never reaches the participants
+        accepted = []
+        for entry in entries:
+            if entry["declared_size"] is not None and entry["declared_size"] != len(entry["data"]):
+                print(f"[Coordinator] {entry['txn_id']}: received {len(entry['data'])} of {entry['declared_size']} declared bytes")
+            elif entry["declared_checksum"] and entry["declared_checksum"] != entry["checksum"]:
+                print(f"[Coordinator] {entry['txn_id']}: declared checksum does not match the uploaded content")
+            else:
+                accepted.append(entry)
+        if not accepted:
+            return
+
+        txn_ids = [entry["txn_id"] for entry in accepted]
+        files = [(entry["filename"], entry["data"]) for entry in accepted]
+        checksums = [entry["checksum"] for entry in accepted]
+        headers = [
+            self.vote_header(entry["txn_id"], entry["filename"], entry["user"], len(entry["data"]), entry["checksum"])
+            for entry in accepted
+        ]
+
+        self.track(txn_ids)
+        try:
+            self.group_round(group_id, txn_ids, files, headers, checksums, accepted)
+        finally:
+            self.untrack(txn_ids)
+
+    def group_round(self, group_id, txn_ids, files, headers, checksums, accepted):
+        # every transaction is logged on its own so recovery can finish each one independently
+        if COMMIT_PROTOCOL != "presumed_abort":
+            for txn_id in txn_ids:
+                self.log.append({"type": "start", "txn": txn_id, "participants": list(self.stubs)})
+
+        _, file_votes, corrupt = self.batch_voting_phase(group_id, txn_ids, files, headers, checksums, atomic=False)
+
+        decisions = {}
+        participants = {}
+        for txn_id in txn_ids:
+            commit = txn_id not in corrupt and all(
+                votes_by_txn is not None and votes_by_txn.get(txn_id, twopc_pb2.VOTE_ABORT) != twopc_pb2.VOTE_ABORT
+                for votes_by_txn in file_votes.values()
+            )
+            decisions[txn_id] = twopc_pb2.GLOBAL_COMMIT if commit else twopc_pb2.GLOBAL_ABORT
+            # read-only and aborting participants have nothing to decide, silent ones might
+            participants[txn_id] = [
+                participant_id for participant_id, votes_by_txn in file_votes.items()
+                if votes_by_txn is None or votes_by_txn.get(txn_id) == twopc_pb2.VOTE_COMMIT
+            ]
+
+        self.group_decision_phase(group_id, decisions, participants)
+
+        for entry in accepted:
+            entry["success"] = decisions[entry["txn_id"]] == twopc_pb2.GLOBAL_COMMIT
+
+    def group_decision_phase(self, group_id, decisions, participants):
+        committed = sum(1 for d in decisions.values() if d == twopc_pb2.GLOBAL_COMMIT)
+        print("*" * 60)
+        print(f"[Coordinator] Starting DECISION PHASE for group {group_id}")
+        print(f"[Coordinator] Decisions: {committed} GLOBAL_COMMIT, {len(decisions) - committed} GLOBAL_ABORT")
+
+        # one forced write makes every decision in the group durable
+        records = []
+        for txn_id, decision in decisions.items():
+            if decision == twopc_pb2.GLOBAL_ABORT and COMMIT_PROTOCOL == "presumed_abort":
+                continue
+            if not participants[txn_id]:
+                # nothing to deliver - close the transaction straight away
+                if COMMIT_PROTOCOL != "presumed_abort":
+                    self.log.append({"type": "end", "txn": txn_id})
+                continue
+            records.append({
+                "type": "decision",
+                "txn": txn_id,
+                "decision": "commit" if decision == twopc_pb2.GLOBAL_COMMIT else "abort",
+                "participants": participants[txn_id]
+            })
+        for i, record in enumerate(records):
+            self.log.append(record, force=i == len(records) - 1)
+        # the last append forced every record before it too - only now may a commit be reported to a participant asking
+        for record in records:
+            if record["decision"] == "commit":
+                self.remember_commit(record["txn"])
+
+        if DECISION_ACK_MODE == "async":
+            self.decision_executor.submit(self.deliver_group_decision, group_id, decisions, participants)
+        else:
+            self.deliver_group_decision(group_id, decisions, participants)
+
+        print("*" * 60)
+
+    def deliver_group_decision(self, group_id, decisions, participants):
+        # one BatchGlobalDecision per participant carries its share of every decision in the group
+        started = time.monotonic()
+        backoff = DECISION_RETRY_BACKOFF
+        pending = {}
+        unacknowledged = {}
+        for txn_id, participant_ids in participants.items():
+            if not participant_ids:
+                continue
+            if decisions[txn_id] == twopc_pb2.GLOBAL_ABORT and COMMIT_PROTOCOL == "presumed_abort":
+                # presumed-abort aborts ride along once and are never waited for
+                unacknowledged[txn_id] = set(participant_ids)
+            else:
+                pending[txn_id] = set(participant_ids)
+
+        for attempt in range(1, DECISION_RETRIES + 1):
+            shares = {}
+            for outstanding in (pending, unacknowledged):
+                for txn_id, participant_ids in outstanding.items():
+                    for participant_id in participant_ids:
+                        shares.setdefault(participant_id, []).append(txn_id)
+            unacknowledged = {}
+
+            calls = {}
+            for participant_id, txn_ids in shares.items():
+                calls[participant_id] = self.send_decisions(participant_id, group_id, [(txn_id, decisions[txn_id]) for txn_id in txn_ids])
+
+            for participant_id, call in calls.items():
+                try:
+                    for ack in call.result().acks:
+                        if ack.success and ack.transaction_id in pending:
+                            pending[ack.transaction_id].discard(participant_id)
+                except grpc.RpcError as e:
+                    print(f"Failed to send decisions to Node {participant_id}: {e}")
+
+            for txn_id in [txn_id for txn_id, participant_ids in pending.items() if not participant_ids]:
+                self.log.append({"type": "end", "txn": txn_id})
+                self.forget(txn_id)
+                del pending[txn_id]
+
+            if not pending:
+                print(f"[Coordinator] Decisions for group {group_id} acknowledged by all participants in {(time.monotonic() - started) * 1000:.1f} ms")
+                return True
+
+            if attempt < DECISION_RETRIES:
+                print(f"[Coordinator] Retrying {len(pending)} decisions for group {group_id} in {backoff:.1f}s")
+                time.sleep(backoff)
+                backoff *= 2
+
+        print(f"[Coordinator] Giving up on {len(pending)} decisions for group {group_id} - {sorted(pending)} never acknowledged")
+        return False
+
+def serve_grpc(port):
+    # participants holding a prepared transaction for too long ask here for its outcome
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    twopc_pb2_grpc.add_TwoPhaseCommitServicer_to_server(coordinator, server)
+    server.add_insecure_port(f'[::]:{port}')
+    server.start()
+    print(f"[Coordinator] gRPC server started on port {port}")
+    server.wait_for_termination()
 
-        return success
-    
 coordinator = TwoPhaseCommitCoordinator()
+group_committer = None
+if GROUP_COMMIT_WINDOW_MS > 0:
+    group_committer = GroupCommitter(coordinator, GROUP_COMMIT_WINDOW_MS / 1000, GROUP_COMMIT_MAX_BATCH, GROUP_COMMIT_WORKERS)
 
 
 # --- JWT Helpers ---
@@ -160,7 +1048,7 @@ def signup():
     hashed_password = generate_password_hash(password)
     try:
         # send to metadata service
-        resp = requests.post(f"{METADATA_API}/users", json={
+        resp = http.post(f"{METADATA_API}/users", json={
             "username": username,
             "password": hashed_password
         })
@@ -188,7 +1076,7 @@ def login():
 
     try:
         # fetch user from metadata service
-        resp = requests.get(f"{METADATA_API}/users/{username}")
+        resp = http.get(f"{METADATA_API}/users/{username}")
 
         # check the response
         if resp.status_code != 200:
@@ -231,7 +1119,7 @@ def require_auth(f):
 @app.route("/files/upload", methods=["POST"])
 @require_auth
 def upload():
-    if "file" not in request.files:
+    if request.mimetype != "multipart/form-data" or "boundary" not in request.mimetype_params:
         return jsonify({"error": "No file part"}), 400
     
     # # get the file
@@ -250,18 +1138,54 @@ def upload():
     # except Exception:
     #     return jsonify({"error": "Non-JSON response from storage", "raw": resp.text}), resp.status_code
 
-    file = request.files["file"]
-    filename = file.filename
-    file_data = file.read()
+    # parse the body as it streams in and hand the chunks straight to the storage prepares
+    upload_stream = UploadStream(request.stream, request.mimetype_params["boundary"])
+    try:
+        filename = upload_stream.open()
+    except ValueError:
+        filename = None
+    if not filename:
+        return jsonify({"error": "No file part"}), 400
+
     username = request.username
+    declared_size = request.headers.get("X-Upload-Size", type=int)
+    declared_checksum = request.headers.get("X-Upload-SHA256", "").lower() or None
+
+    # only the real body length decides whether an upload is small enough to buffer - X-Upload-Size is the
+    # client's word, and a chunked body has no length at all. reading stops at the cap whatever it says
+    chunks = upload_stream.chunks()
+    buffered = []
+    grouped = False
+    if group_committer is not None and request.content_length is not None and request.content_length <= GROUP_COMMIT_MAX_BYTES:
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > GROUP_COMMIT_MAX_BYTES:
+                break
+        else:
+            grouped = True
 
-    success = coordinator.execute_upload(filename, file_data, username)
+    if grouped:
+        # share a 2PC round with whatever else arrives in the window
+        success, checksum = group_committer.submit(filename, b"".join(buffered), username, declared_size, declared_checksum)
+    else:
+        # whatever was already buffered goes out first, then the rest as it streams in
+        success, size, checksum = coordinator.execute_upload(
+            filename,
+            itertools.chain(buffered, chunks),
+            username,
+            declared_size=declared_size,
+            size_hint=request.content_length or 0,
+            declared_checksum=declared_checksum
+        )
 
     if success:
         return jsonify({
             "message": "File uploaded successfully via 2PC",
             "filename": filename,
-            "size": len(file_data)}
+            "size": size,
+            "sha256": checksum}
         ), 200
     else:
         return jsonify({
@@ -269,18 +1193,82 @@ def upload():
             "filename": filename
         }), 500
 
+# batch upload endpoint - many small files committed atomically in one 2PC round
+@app.route("/files/upload/batch", methods=["POST"])
+@require_auth
+def upload_batch():
+    if request.content_length is not None and request.content_length > BATCH_MAX_BYTES:
+        return jsonify({"error": f"Batch larger than {BATCH_MAX_BYTES} bytes"}), 413
+
+    # a chunked body has no Content-Length to check up front - cap it while the form is parsed instead
+    # (Flask 3.0 has no per-request max_content_length)
+    request.environ["wsgi.input"] = LimitedStream(request.environ["wsgi.input"], BATCH_MAX_BYTES, is_max=True)
+    try:
+        uploads = request.files.getlist("files")
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Batch larger than {BATCH_MAX_BYTES} bytes"}), 413
+    if not uploads:
+        return jsonify({"error": "No file part"}), 400
+    if len(uploads) > BATCH_MAX_FILES:
+        return jsonify({"error": f"Batch has more than {BATCH_MAX_FILES} files"}), 413
+
+    files = [(f.filename, f.read()) for f in uploads]
+    filenames = [filename for filename, _ in files]
+    if not all(filenames):
+        return jsonify({"error": "Every file needs a filename"}), 400
+    if len(set(filenames)) != len(filenames):
+        return jsonify({"error": "Duplicate filename in batch"}), 400
+
+    success, batch_id, checksums = coordinator.execute_batch_upload(files, request.username)
+
+    if success:
+        return jsonify({
+            "message": "Batch uploaded successfully via 2PC",
+            "batch_id": batch_id,
+            "files": [
+                {"filename": filename, "size": len(data), "sha256": checksum}
+                for (filename, data), checksum in zip(files, checksums)
+            ]}
+        ), 200
+    else:
+        return jsonify({
+            "error": "Batch upload failed - transaction aborted",
+            "batch_id": batch_id,
+            "files": filenames
+        }), 500
+
+# usage endpoint - file count and bytes stored by the logged-in user
+@app.route("/files/usage", methods=["GET"])
+@require_auth
+def usage():
+    resp = http.get(f"{METADATA_API}/users/{request.username}/usage")
+
+    if resp.status_code == 200:
+        return resp.json(), resp.status_code
+    else:
+        return jsonify({"error": "Metadata error - " + resp.text}), 500
+
 # list files endpoint
 @app.route("/files", methods=["GET"])
 @require_auth
 def list_files():
-    # forward request to metadata service via GET
-    resp = requests.get(f"{METADATA_API}/files")
+    # forward one page at a time to the metadata service - limit, cursor, prefix and user pass straight through
+    params = {key: request.args[key] for key in ("limit", "cursor", "prefix", "user") if key in request.args}
+    headers = {"Accept": request.headers["Accept"]} if "Accept" in request.headers else {}
+    resp = http.get(f"{METADATA_API}/files", params=params, headers=headers, stream=True)
+
+    # a streamed listing (NDJSON or MessagePack) is relayed chunk by chunk as it arrives
+    if resp.status_code == 200 and resp.headers.get("Content-Type", "").startswith(("application/x-ndjson", "application/x-msgpack")):
+        return Response(resp.iter_content(chunk_size=64 * 1024), status=200, content_type=resp.headers["Content-Type"])
 
     # check response from metadata service
-    if resp.status_code == 200:
+    if resp.status_code in (200, 400, 406):
         return resp.json(), resp.status_code
     else:
         return jsonify({"error": "Metadata error - " + resp.text}), 500
 
 if __name__ == "__main__":
+    grpc_port = int(os.environ.get('GRPC_PORT', '50051'))
+    threading.Thread(target=serve_grpc, args=(grpc_port,), daemon=True).start()
+
     app.run(host="0.0.0.0", port=5003)
\ No newline at end of file
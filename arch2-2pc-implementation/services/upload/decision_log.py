@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+
+
+class DecisionLog:
+    # append-only log of coordinator decisions - forced records from concurrent transactions share one fsync.
+    # every checkpoint_every records the log is rewritten with only the records of transactions that have
+    # no end record yet, so it stays as long as the work still in flight instead of growing forever
+    def __init__(self, path, group_commit=True, batch_window=0.002, checkpoint_every=10000):
+        self.path = path
+        self.group_commit = group_commit
+        self.batch_window = batch_window
+        self.checkpoint_every = checkpoint_every
+        self.fsyncs = 0
+
+        self.directory = os.path.dirname(path)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self._truncate_torn_tail()
+
+        # the lines of every unfinished transaction, in the order they were appended
+        self.live = {}
+        self.kept = 0
+        self.written = 0
+        for record in read_records(path):
+            self._track(record, json.dumps(record, separators=(",", ":")) + "\n")
+            self.written += 1
+        self.file = None
+        self._checkpoint()
+
+        self.cond = threading.Condition()
+        self.pending = []
+        self.appended_seq = 0
+        self.forced_seq = 0
+        self.durable_seq = 0
+        self.closed = False
+
+        if group_commit:
+            self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flusher.start()
+
+    def append(self, record, force=False):
+        # forced records return only once they are on disk, the others ride along with the next fsync
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+
+        with self.cond:
+            self._track(record, line)
+            if not self.group_commit:
+                self.file.write(line)
+                self.written += 1
+                if self.written >= self.checkpoint_every:
+                    self._checkpoint()
+                elif force:
+                    self._sync()
+                return
+
+            self.pending.append(line)
+            self.appended_seq += 1
+            if not force:
+                return
+
+            seq = self.appended_seq
+            self.forced_seq = seq
+            self.cond.notify_all()
+            while self.durable_seq < seq:
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        if self.group_commit:
+            self.flusher.join()
+        else:
+            self._sync()
+        self.file.close()
+
+    def _flush_loop(self):
+        while True:
+            with self.cond:
+                while self.forced_seq <= self.durable_seq and not self.closed:
+                    self.cond.wait()
+                if self.closed and not self.pending:
+                    return
+
+            # give concurrent transactions a moment to join this batch
+            if self.batch_window > 0 and not self.closed:
+                time.sleep(self.batch_window)
+
+            with self.cond:
+                if self.written >= self.checkpoint_every:
+                    # the rewritten log already holds every record appended so far
+                    self.pending = []
+                    self._checkpoint()
+                    self.durable_seq = self.appended_seq
+                    self.cond.notify_all()
+                    continue
+                batch = self.pending
+                self.pending = []
+                seq = self.appended_seq
+
+            self.file.writelines(batch)
+            self.written += len(batch)
+            self._sync()
+
+            with self.cond:
+                self.durable_seq = seq
+                self.cond.notify_all()
+
+    def _track(self, record, line):
+        # caller holds cond - an end record means the transaction needs nothing more from the log
+        if record["type"] == "end":
+            self.live.pop(record["txn"], None)
+        else:
+            self.live.setdefault(record["txn"], []).append(line)
+
+    def _checkpoint(self):
+        # caller holds cond, or is __init__ - the new log is written beside the old one and renamed over it,
+        # so a crash leaves one or the other whole
+        started = time.monotonic()
+        kept = sum(len(lines) for lines in self.live.values())
+        dropped = self.kept + self.written - kept
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            for lines in self.live.values():
+                f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        dir_fd = os.open(self.directory or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self.fsyncs += 1
+
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.kept = kept
+        self.written = 0
+        print(f"[DecisionLog] Checkpoint kept {len(self.live)} unfinished transactions, dropped {dropped} records "
+              f"in {time.monotonic() - started:.2f}s")
+
+    def _truncate_torn_tail(self):
+        # a crash mid-write can leave a partial last line - drop it so new records start on a fresh line
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - 4096)
+                f.seek(start)
+                newline = f.read(pos - start).rfind(b"\n")
+                if newline != -1:
+                    pos = start + newline + 1
+                    break
+                pos = start
+
+            if pos != end:
+                print(f"[DecisionLog] Dropping {end - pos} bytes of torn record from {self.path}")
+                f.truncate(pos)
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.fsyncs += 1
+
+
+def read_records(path):
+    # yields every complete record - a torn last line from a crash mid-write is skipped
+    if not os.path.exists(path):
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"[DecisionLog] Skipping torn record in {path}")
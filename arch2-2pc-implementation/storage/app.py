@@ -1,27 +1,51 @@
 from flask import Flask, request, jsonify, send_file
 from concurrent import futures
-import os, grpc, sys
+import os, grpc, sys, hashlib, hmac, time
 import requests, threading
 
 sys.path.insert(0, '/app/proto')
 import twopc_pb2
 import twopc_pb2_grpc
 
+sys.path.insert(0, '/app/common')
+from lock_table import LockTable
+from participant import Participant, READ_ONLY, PREPARED_TIMEOUT
+
 app = Flask(__name__)
 
-STORAGE_PATH = "/storage"
-TEMP_PATH = "/storage/temp"
+STORAGE_PATH = os.environ.get("STORAGE_PATH", "/storage")
+TEMP_PATH = os.path.join(STORAGE_PATH, "temp")
+CHECKSUM_PATH = os.path.join(STORAGE_PATH, "checksums") # sha256 of every committed file, kept beside the data
 METADATA_API = "http://metadata1:5005/files"
+LOCK_STRIPES = int(os.environ.get("LOCK_STRIPES", "64")) # mutexes the filename lock table is striped over
+LOCK_WAIT_MS = float(os.environ.get("LOCK_WAIT_MS", "0")) # how long a prepare waits for a filename held by another transaction, 0 aborts at once
+GRPC_MAX_MESSAGE = int(os.environ.get("GRPC_MAX_MESSAGE", str(64 * 1024 * 1024))) # largest gRPC message accepted - batched uploads carry their files inline
+DOWNLOAD_SIGNING_KEY = os.environ.get("DOWNLOAD_SIGNING_KEY", "") # when set, /download only serves URLs signed by the download service with this key
 
 os.makedirs(STORAGE_PATH, exist_ok=True)
 os.makedirs(TEMP_PATH, exist_ok=True)
+os.makedirs(CHECKSUM_PATH, exist_ok=True)
+
+def checksum_file(filename):
+    return os.path.join(CHECKSUM_PATH, f"{filename}.sha256")
 
-class StorageParticipant(twopc_pb2_grpc.TwoPhaseCommitServicer):
+def stored_checksum(filename):
+    # the recorded hash of the committed file, or None if there is no such file
+    if not os.path.exists(os.path.join(STORAGE_PATH, filename)):
+        return None
+    try:
+        with open(checksum_file(filename)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+class StorageParticipant(Participant, twopc_pb2_grpc.TwoPhaseCommitServicer, twopc_pb2_grpc.DecisionChannelServicer):
     def __init__(self, node_id):
-        self.node_id = node_id
+        super().__init__(node_id)
         self.storage_path = STORAGE_PATH
         self.temp_path = TEMP_PATH
-        self.prepared_transactions = {}
+        # a prepared transaction holds its filename until the decision arrives
+        self.locks = LockTable(stripes=LOCK_STRIPES, wait_ms=LOCK_WAIT_MS)
 
         print(f"[Storage Node {self.node_id}] Intialized...")
         print(f" Storage path: {self.storage_path}")
@@ -31,106 +55,159 @@ class StorageParticipant(twopc_pb2_grpc.TwoPhaseCommitServicer):
         caller_node_id = "1"
         print(f"\nPhase Voting of Node {self.node_id} receives RPC VoteRequest from Phase Voting of Node {caller_node_id}")
 
+        return self.prepare(request, [request.file_data], context)
+
+    def VoteRequestStream(self, request_iterator, context):
+        caller_node_id = "1"
+        print(f"\nPhase Voting of Node {self.node_id} receives RPC VoteRequestStream from Phase Voting of Node {caller_node_id}")
+
+        header = next(request_iterator).header
+        return self.prepare(header, (message.chunk for message in request_iterator), context)
+
+    def prepare(self, request, chunks, context):
         txn_id = request.transaction_id
         filename = request.filename
-        file_data = request.file_data
+        expected_size = request.metadata.size
 
         print(f"  [Node {self.node_id}] Transaction ID: {txn_id}")
         print(f"  [Node {self.node_id}] Operation: {request.operation}")
         print(f"  [Node {self.node_id}] Filename: {filename}")
-        print(f"  [Node {self.node_id}] File size: {len(file_data)} bytes")
-              
+        print(f"  [Node {self.node_id}] File size: {expected_size} bytes")
+
+        temp_file_path = os.path.join(self.temp_path, f"{txn_id}_{filename}")
+        final_file_path = os.path.join(self.storage_path, filename)
+
         try:
-            temp_file_path = os.path.join(self.temp_path, f"{txn_id}_{filename}")
-            final_file_path = os.path.join(self.storage_path, filename)
+            # taken before any bytes are read, so a conflicting upload aborts without being transferred
+            holder = self.locks.acquire(filename, txn_id)
+            if holder is not None:
+                raise Exception(f"File '{filename}' is locked by transaction {holder}")
 
             print(f"  [Node {self.node_id}] Saving to temp: {temp_file_path}")
 
+            # append each chunk as it arrives so memory stays bounded by the chunk size
+            received = 0
+            sha256 = hashlib.sha256()
             with open(temp_file_path, 'wb') as f:
-                f.write(file_data)
-            
+                for chunk in chunks:
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    received += len(chunk)
+
             if not os.path.exists(temp_file_path):
                 raise Exception("File not written successfully")
-            
-            self.prepared_transactions[txn_id] = {
-                'temp_path': temp_file_path,
-                'final_path': final_file_path,
-                'operation': request.operation,
-                'filename': filename
-            }
-
-            print(f"  [Node {self.node_id}] File saved to temp location")
+
+            if expected_size and received != expected_size:
+                raise Exception(f"Received {received} of {expected_size} bytes")
+
+            # the coordinator cancels outstanding prepares once another node votes abort
+            if not context.is_active():
+                raise Exception("VoteRequest cancelled by coordinator")
+
+            checksum = sha256.hexdigest()
+            if stored_checksum(filename) == checksum:
+                # this node already holds identical content - nothing to commit or roll back
+                os.remove(temp_file_path)
+                self.locks.release(filename, txn_id)
+                self.remember_outcome(txn_id, READ_ONLY)
+                print(f"  [Node {self.node_id}] Identical content already stored as {final_file_path}")
+                print(f"  [Node {self.node_id}] Voting: VOTE_READ_ONLY")
+
+                return twopc_pb2.VoteResponse(
+                    transaction_id=txn_id,
+                    vote=twopc_pb2.VOTE_READ_ONLY,
+                    node_id=self.node_id,
+                    checksum=checksum
+                )
+
+            with self.completed_lock:
+                # a vote request arriving late, after this node already applied the abort, must not prepare it again
+                if self.completed_transactions.get(txn_id) == twopc_pb2.GLOBAL_ABORT:
+                    raise Exception("Transaction already aborted")
+                self.prepared_transactions[txn_id] = {
+                    'temp_path': temp_file_path,
+                    'final_path': final_file_path,
+                    'operation': request.operation,
+                    'filename': filename,
+                    'checksum': checksum,
+                    'prepared_at': time.monotonic()
+                }
+
+            print(f"  [Node {self.node_id}] File saved to temp location ({received} bytes)")
             print(f"  [Node {self.node_id}] Voting: VOTE_COMMIT")
 
             return twopc_pb2.VoteResponse(
                 transaction_id=txn_id,
                 vote=twopc_pb2.VOTE_COMMIT,
-                node_id=self.node_id
+                node_id=self.node_id,
+                checksum=checksum
             )
-        
+
         except Exception as e:
             print(f"[Node {self.node_id}] Error: {e}")
             print(f"[Node {self.node_id}] Voting: VOTE_ABORT")
 
+            if txn_id not in self.prepared_transactions:
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
+                self.locks.release(filename, txn_id)
+
             return twopc_pb2.VoteResponse(
                 transaction_id=txn_id,
                 vote=twopc_pb2.VOTE_ABORT,
                 node_id=self.node_id,
                 reason=str(e)
             )
-    
-    def GlobalDecision(self, request, context):
-        caller_node_id = "1"
-        print(f"\n Phase Decision of Node {self.node_id} receives RPC GlobalDecision from Phase Decision of Node {caller_node_id}")
-
-        txn_id = request.transaction_id
-        decision = request.decision
-
-        decision_str = "GLOBAL_COMMIT" if decision == twopc_pb2.GLOBAL_COMMIT else "GLOBAL_ABORT"
-        print(f"[Node {self.node_id}] Transaction ID: {txn_id}")
-        print(f"[Node {self.node_id}] Decision: {decision_str}")
-
-        if txn_id not in self.prepared_transactions:
-            print(f"[Node {self.node_id}] Transaction not found in prepared state")
-            return twopc_pb2.DecisionAck(
-                transaction_id=txn_id,
-                node_id=self.node_id,
-                success=False
-            )
-        
-        txn = self.prepared_transactions[txn_id]
-
-        try:
-            if decision == twopc_pb2.GLOBAL_COMMIT:
-                os.rename(txn['temp_path'], txn['final_path'])
-                print(f"[Node {self.node_id}] COMMITED: {txn['temp_path']} to {txn['final_path']}")
 
-            else:
-                if os.path.exists(txn['temp_path']):
-                    os.remove(txn['temp_path'])
-                print(f"[Node {self.node_id}] ABORTED: Deleted {txn['temp_path']}")
-
-            del self.prepared_transactions[txn_id]
+    def apply_decision(self, txn_id, txn, decision):
+        if decision == twopc_pb2.GLOBAL_COMMIT:
+            os.rename(txn['temp_path'], txn['final_path'])
+            with open(checksum_file(txn['filename']), 'w') as f:
+                f.write(txn['checksum'])
+            print(f"[Node {self.node_id}] COMMITED: {txn['temp_path']} to {txn['final_path']}")
+        else:
+            print(f"[Node {self.node_id}] ABORTED: Deleting {txn['temp_path']}")
+
+    def release_prepared(self, txn_id, txn):
+        # the temp file is already gone once a commit has renamed it
+        if os.path.exists(txn['temp_path']):
+            os.remove(txn['temp_path'])
+        self.locks.release(txn['filename'], txn_id)
+
+    def sweep(self):
+        super().sweep()
+        self.remove_orphaned_temp_files()
+
+    def remove_orphaned_temp_files(self):
+        # temp files no prepared transaction owns any more, e.g. left behind by a restart of this node
+        prepared_paths = {txn['temp_path'] for txn in list(self.prepared_transactions.values())}
+        cutoff = time.time() - PREPARED_TIMEOUT
+        for name in os.listdir(self.temp_path):
+            path = os.path.join(self.temp_path, name)
+            try:
+                if path not in prepared_paths and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    print(f"[Node {self.node_id}] Removed orphaned temp file {path}")
+            except OSError:
+                continue
+
+storage_participant = None
 
-            return twopc_pb2.DecisionAck(
-                transaction_id=txn_id,
-                node_id=self.node_id,
-                success=True
-            )
-        
-        except Exception as e:
-            print(f"[Node {self.node_id}] Error during {decision_str}: {e}")
-            return twopc_pb2.DecisionAck(
-                transaction_id=txn_id,
-                node_id=self.node_id,
-                success=False
-            )
-        
 def serve_grpc(node_id, port):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    global storage_participant
+
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=10),
+        options=[
+            ('grpc.max_receive_message_length', GRPC_MAX_MESSAGE),
+            ('grpc.max_send_message_length', GRPC_MAX_MESSAGE)
+        ]
+    )
 
-    participant = StorageParticipant(node_id)
-    twopc_pb2_grpc.add_TwoPhaseCommitServicer_to_server(participant, server)
+    storage_participant = StorageParticipant(node_id)
+    twopc_pb2_grpc.add_TwoPhaseCommitServicer_to_server(storage_participant, server)
+    twopc_pb2_grpc.add_DecisionChannelServicer_to_server(storage_participant, server)
+    threading.Thread(target=storage_participant.reap, daemon=True).start()
 
     server.add_insecure_port(f'[::]:{port}')
     server.start()
@@ -194,12 +271,29 @@ def download_file():
     if not filename:
         return jsonify({"error": "Filename required"}), 400
 
+    # clients redirected here by the download service carry its signature instead of a token
+    if DOWNLOAD_SIGNING_KEY and not valid_signature(filename, request.args.get("expires"), request.args.get("signature")):
+        return jsonify({"error": "Invalid or expired download signature"}), 403
+
     # Check if file exists in storage
     file_path = os.path.join(STORAGE_PATH, filename)
     if not os.path.exists(file_path):
         return jsonify({"error": "File not found"}), 404
 
-    return send_file(file_path, as_attachment=True)
+    # conditional send_file answers Range with 206, and If-Range against the ETag - the content hash,
+    # so a resumed download only continues if the file is still the same one
+    checksum = stored_checksum(filename)
+    return send_file(file_path, as_attachment=True, conditional=True, etag=checksum if checksum else True)
+
+def valid_signature(filename, expires, signature):
+    # HMAC of "<filename>:<expires>" as the download service signs it, not yet expired
+    try:
+        if int(expires) < time.time():
+            return False
+    except (TypeError, ValueError):
+        return False
+    expected = hmac.new(DOWNLOAD_SIGNING_KEY.encode(), f"{filename}:{expires}".encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or "")
 
 # ---------------- Delete ----------------
 @app.route("/delete", methods=["DELETE"])
@@ -208,11 +302,17 @@ def delete_file():
     if not filename:
         return jsonify({"error": "Filename required"}), 400
 
+    # a prepared upload of the same name would put the file straight back
+    if storage_participant is not None and storage_participant.locks.holder(filename) is not None:
+        return jsonify({"error": "File is being uploaded"}), 409
+
     # Delete file from storage
     file_path = os.path.join(STORAGE_PATH, filename)
     try:
         if os.path.exists(file_path):
             os.remove(file_path)
+            if os.path.exists(checksum_file(filename)):
+                os.remove(checksum_file(filename))
         else:
             return jsonify({"error": "File not found"}), 404
     except Exception as e:
@@ -227,6 +327,14 @@ def delete_file():
 
     return jsonify({"status": "deleted"}), 200
 
+# ---------------- Lock Stats ----------------
+@app.route("/locks/stats", methods=["GET"])
+def lock_stats():
+    # lock-wait and lock-hold histograms of the filename lock table
+    if storage_participant is None:
+        return jsonify({"error": "gRPC server not started"}), 503
+    return jsonify(storage_participant.locks.stats()), 200
+
 # ---------------- Main ----------------
 if __name__ == "__main__":
     node_id = os.environ.get('NODE_ID', '2')